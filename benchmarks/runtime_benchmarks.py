@@ -0,0 +1,329 @@
+""" Micro-benchmarks of the generated meta model runtime operations.
+
+The meta model is generated from the bundled metamodel job (or the cache),
+then per store (dict, sqlite, frozen, fork) and population size a fresh
+population is made: size instances of a parent class and per parent four
+instances of the child class its navigation refers to (by default Class
+and Attribute by R20). Every operation is timed in isolation, over a
+prepared list of inputs, after warmup rounds:
+
+constraint init:       child.constraint(data)
+and:                   partial & partial, two halves of an instance
+try_key:               instance.try_key(first identifier)
+new:                   child.new into an empty population (a fork of the
+                       full one for fork, not for frozen)
+query keyed:           child.query by the first identifier
+query unkeyed:         child.query by the parent's referential attributes,
+                       distinct constraints and the query cache cleared
+                       every round, hence a scan per query
+query unkeyed cached:  the same constraint every time
+navigation:            parent_i.R<n>()
+navigate and query:    child.query(parent_i.R<n>()), scanning as above
+all:                   child.all()
+
+The results (ns per operation: median, mean, stdev and min over the rounds)
+are written as JSON. --compare a JSON of an earlier run reports the ratio of
+the medians and exits with an error if any exceeds --threshold, e.g.:
+
+    python benchmarks/runtime_benchmarks.py -o before.json
+    (change the template)
+    python benchmarks/runtime_benchmarks.py -o after.json --compare before.json
+"""
+import argparse
+import gc
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from mana.generators.meta_model_generator import MetaModelGenerator
+from mana.generators.meta_model_loader import MetaModelCode, default_cache_dir, fork_population, load_meta_model
+from mana.jobs import json_job
+from mana.runtime import freeze
+from mana.sqlite_store import SqliteDatabase
+
+stores = ('dict', 'sqlite', 'frozen', 'fork')
+children_per_parent = 4
+# distinct constraints per round of the operations that scan the population
+scan_queries = 50
+# calls of all per round
+all_calls = 20
+
+
+def meta_model_code(meta_model_job: Path, cache_dir: Optional[Path]) -> MetaModelCode:
+    mmg = MetaModelGenerator(json_job(meta_model_job))
+    code = None if cache_dir is None else mmg.cached_code(cache_dir)
+    if code is None:
+        mmg.parse()
+        mmg.interpret()
+        code = mmg.generate_code(cache_dir)
+    return code
+
+
+def instance_data(_class: type, number: int) -> dict:
+    """ Attribute values of a made up instance, unique per number """
+    return {attr: f'{attr} {number}' for attr in _class.attr_list}
+
+
+class Population:
+    """ A population of one store kind and size, the inputs of the
+    operations and a population to time new in """
+    def __init__(self, code: MetaModelCode, store: str, size: int, parent_name: str, rnum: str):
+        self.code = code
+        self.store = store
+        self.rnum = rnum
+        self.parent_name = parent_name
+        self.meta_model = self.load()
+        parent = getattr(self.meta_model, parent_name)
+        child_name, ref_table = parent.references[rnum]
+        self.child_name = child_name
+        self.ref_table = ref_table
+
+        self.parent_data = [instance_data(parent, number) for number in range(size)]
+        self.child_data = self.children(getattr(self.meta_model, child_name))
+        self.populate(self.meta_model)
+        if store == 'frozen':
+            freeze(self.meta_model)
+        elif store == 'fork':
+            self.base = self.meta_model
+            self.meta_model = fork_population(self.base)
+        self.parent = getattr(self.meta_model, parent_name)
+        self.child = getattr(self.meta_model, child_name)
+
+    def load(self):
+        """ An empty population, a fork of the full one for fork """
+        if self.store == 'fork' and hasattr(self, 'base'):
+            return fork_population(self.base)
+        meta_model = load_meta_model(self.code)
+        if self.store == 'sqlite':
+            SqliteDatabase(':memory:').attach(meta_model)
+        return meta_model
+
+    def children(self, child: type) -> list[dict]:
+        out = []
+        for parent_data in self.parent_data:
+            for _ in range(children_per_parent):
+                data = instance_data(child, len(out))
+                for attr_source, attr_ref in self.ref_table:
+                    data[attr_ref] = parent_data[attr_source]
+                out.append(data)
+        return out
+
+    def populate(self, meta_model):
+        parent = getattr(meta_model, self.parent_name)
+        child = getattr(meta_model, self.child_name)
+        for data in self.parent_data:
+            parent.new(parent.constraint(data))
+        for data in self.child_data:
+            child.new(child.constraint(data))
+
+    def operations(self) -> dict[str, tuple[Callable[[], None], int, Optional[Callable[[], None]]]]:
+        """ name -> (timed function, operations per call, setup per round) """
+        parent, child = self.parent, self.child
+        constraint = child.constraint
+        id_list = child.id_lists[0]
+        instances = child.all()
+        parents = parent.all()
+        halves = [(constraint(dict(list(data.items())[:len(data) // 2])),
+                   constraint(dict(list(data.items())[len(data) // 2:]))) for data in self.child_data]
+        keyed = [constraint({attr: data[attr] for attr in id_list}) for data in self.child_data]
+        unkeyed = [constraint({attr_ref: data[attr_source] for attr_source, attr_ref in self.ref_table})
+                   for data in self.parent_data[:scan_queries]]
+        rnum = self.rnum
+        child_data = self.child_data
+        # not in any population (a fork's parent holds the others)
+        new_data = [instance_data(child, number + len(child_data)) for number in range(len(child_data))]
+        fresh = dict()
+
+        def init():
+            for data in child_data:
+                constraint(data)
+
+        def _and():
+            for first, second in halves:
+                first & second
+
+        def try_key():
+            for instance in instances:
+                instance.try_key(id_list)
+
+        def new_setup():
+            meta_model = self.load()
+            fresh['class'] = getattr(meta_model, self.child_name)
+            fresh['instances'] = [fresh['class'].constraint(data) for data in new_data]
+
+        def new():
+            new_class = fresh['class']
+            for instance in fresh['instances']:
+                new_class.new(instance)
+            len(new_class.store)  # a database inserts the pending rows
+
+        def query_keyed():
+            query = child.query
+            for key_constraint in keyed:
+                query(key_constraint)
+
+        def query_unkeyed():
+            query = child.query
+            for ref_constraint in unkeyed:
+                query(ref_constraint)
+
+        cached = unkeyed[:1] * len(parents)
+
+        def query_unkeyed_cached():
+            query = child.query
+            for ref_constraint in cached:
+                query(ref_constraint)
+
+        def navigation():
+            for parent_i in parents:
+                getattr(parent_i, rnum)()
+
+        def navigate_query():
+            query = child.query
+            for parent_i in parents[:scan_queries]:
+                query(getattr(parent_i, rnum)())
+
+        def _all():
+            for _ in range(all_calls):
+                child.all()
+
+        out = {'constraint init': (init, len(child_data), None),
+               'and': (_and, len(halves), None),
+               'try_key': (try_key, len(instances), None),
+               'new': (new, len(new_data), new_setup),
+               'query keyed': (query_keyed, len(keyed), None),
+               'query unkeyed': (query_unkeyed, len(unkeyed), child.query_cache.clear),
+               'query unkeyed cached': (query_unkeyed_cached, len(cached), None),
+               'navigation': (navigation, len(parents), None),
+               'navigate and query': (navigate_query, len(parents[:scan_queries]), child.query_cache.clear),
+               'all': (_all, all_calls, None)}
+        if self.store == 'frozen':
+            del out['new']  # a frozen population can not change
+        return out
+
+
+def measure(function: Callable[[], None], operations: int, setup: Optional[Callable[[], None]],
+            rounds: int, warmup: int) -> dict:
+    """ ns per operation over the rounds after the warmup rounds, with the
+    garbage collector off while timing (as timeit) """
+    samples = []
+    for round_number in range(warmup + rounds):
+        if setup is not None:
+            setup()
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter_ns()
+            function()
+            elapsed = time.perf_counter_ns() - start
+        finally:
+            gc.enable()
+        if round_number >= warmup:
+            samples.append(elapsed / operations)
+    return {'median_ns': statistics.median(samples),
+            'mean_ns': statistics.fmean(samples),
+            'stdev_ns': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+            'min_ns': min(samples),
+            'rounds': rounds,
+            'operations': operations}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=Path(__file__).parent,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_key(result: dict) -> tuple:
+    return result['store'], result['size'], result['operation']
+
+
+def compare(results: list[dict], baseline: list[dict], threshold: float) -> list[dict]:
+    """ The results slower than threshold times the baseline median """
+    before = {result_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        old = before.get(result_key(result))
+        if old is None or not old['median_ns']:
+            continue
+        ratio = result['median_ns'] / old['median_ns']
+        flag = ' <- slower' if ratio > threshold else ''
+        print(f"{result['store']:7} {result['size']:>7} {result['operation']:22} "
+              f"{old['median_ns']:10.0f} -> {result['median_ns']:10.0f} ns  x{ratio:.2f}{flag}")
+        if ratio > threshold:
+            regressions.append(result)
+    return regressions
+
+
+def arguments(argv):
+    examples_path = Path(__file__).resolve().parent.parent / 'mana' / 'examples'
+    parser = argparse.ArgumentParser(description='Micro-benchmarks of the generated meta model runtime')
+    parser.add_argument('--meta-model', type=Path, default=examples_path / 'shlaer-mellor-metamodel.json',
+                        help='meta model job file (default: the bundled Shlaer-Mellor metamodel)')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000],
+                        help='parent instances per population (default: 100 1000 10000)')
+    parser.add_argument('--stores', nargs='+', choices=stores, default=list(stores))
+    parser.add_argument('--operations', nargs='+', help='only these operations (default: all)')
+    parser.add_argument('--navigation', nargs=2, default=['Class', 'R20'], metavar=('CLASS', 'RNUM'),
+                        help='parent class (code name) and the reference to its children (default: Class R20)')
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('-o', '--output', type=Path, help='write the results as JSON')
+    parser.add_argument('--compare', type=Path, help='results JSON of an earlier run')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='median ratio to the earlier run counted as slower (default: 1.25)')
+    parser.add_argument('--cache-dir', type=Path, default=default_cache_dir())
+    parser.add_argument('--no-cache', action='store_true', help='neither read nor write the meta model cache')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = arguments(argv)
+    code = meta_model_code(args.meta_model, None if args.no_cache else args.cache_dir)
+    parent_name, rnum = args.navigation
+
+    results = []
+    for store in args.stores:
+        for size in args.sizes:
+            population = Population(code, store, size, parent_name, rnum)
+            for operation, (function, operations, setup) in population.operations().items():
+                if args.operations and operation not in args.operations:
+                    continue
+                result = {'operation': operation, 'store': store, 'size': size} | measure(
+                    function, operations, setup, args.rounds, args.warmup)
+                results.append(result)
+                print(f"{store:7} {size:>7} {operation:22} {result['median_ns']:10.0f} ns "
+                      f"(stdev {result['stdev_ns']:.0f})")
+
+    report = {'commit': git_commit(),
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'meta_model': str(args.meta_model),
+              'navigation': [parent_name, rnum],
+              'children_per_parent': children_per_parent,
+              'results': results}
+    if args.output is not None:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=1)
+
+    if args.compare is not None:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        print(f"compared to {baseline.get('commit')}")
+        regressions = compare(results, baseline['results'], args.threshold)
+        if regressions:
+            sys.exit(f'{len(regressions)} operation(s) more than {args.threshold}x slower')
+
+
+if __name__ == '__main__':
+    main()
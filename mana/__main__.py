@@ -1,11 +1,16 @@
-
+import argparse
+import os
 import sys
-import json
 from pathlib import Path
 import time
 
 from mana.generators.meta_model_generator import MetaModelGenerator
-from mana.warnings_and_exceptions import ManaException
+from mana.generators.meta_model_loader import default_cache_dir
+from mana.debug_artifacts import ArtifactWriter, artifact_kinds
+from mana.batch import job_paths, run_batch
+from mana import tracing
+from mana.jobs import json_job
+from mana.warnings_and_exceptions import ManaException, output_str
 
 
 prev_time = 0.0
@@ -20,45 +25,87 @@ def print_time(message: str):
     print(message, round(new_time - prev_time, 0), 'secs', end='\n')
     prev_time = new_time
 
-def json_job(job_path: Path):
-    with open(job_path) as job_file:
-        data_in_file = json.load(job_file)
-    
-    path_at_file = job_path.resolve().parent
-    if 'subsystems' not in data_in_file:
-        raise ManaException()
-    
-    out = {
-        'subsystems': [path_at_file / subsystem for subsystem in data_in_file['subsystems']],
-        'statemodels': [path_at_file / subsystem for subsystem in data_in_file.get('statemodels', [])]}
-       
-    return out
+def print_result(result: dict):
+    seconds = round(result['timings']['total'], 2)
+    if result['ok']:
+        print('ok    ', result['job'], result['instances'], 'instances', seconds, 'secs')
+    else:
+        print('failed', result['job'], seconds, 'secs')
+        print(result['error']['message'] or output_str(result['error']['exception']))
 
-def main():
+def arguments(argv):
     examples_path = Path(__file__).parent / "examples"
-    
-    meta_model_path = examples_path / "shlaer-mellor-metamodel.json"
-    # my_model_path = meta_model_path
-    my_model_path = examples_path / 'test-model.json'
-    
-    
+
+    parser = argparse.ArgumentParser(
+        prog='mana',
+        description='xUML Model Analyzer, instantiates model jobs against a generated meta model')
+    parser.add_argument('jobs', nargs='*', type=Path,
+                        help='job files, or directories of job files (default: the example test model)')
+    parser.add_argument('--meta-model', type=Path, default=examples_path / "shlaer-mellor-metamodel.json",
+                        help='meta model job file (default: the bundled Shlaer-Mellor metamodel)')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1,
+                        help='worker processes (default: one per core)')
+    parser.add_argument('-o', '--output', type=Path,
+                        help='write a <job>.result.json per job to this directory')
+    parser.add_argument('--export', action='store_true',
+                        help='include the population as facts in the results')
+    parser.add_argument('--statistics', action='store_true',
+                        help='include instance counts and memory estimates per class in the results')
+    parser.add_argument('--materialize-canthappen', action='store_true',
+                        help='instantiate the implicit "can\'t happen" event responses too')
+    parser.add_argument('--database-dir', type=Path,
+                        help='keep each population in a <job>.sqlite database in this directory')
+    parser.add_argument('--trace-dir', type=Path,
+                        help='write Chrome trace files (meta-model.trace.json, <job>.trace.json) to this directory')
+    parser.add_argument('--cache-dir', type=Path, default=default_cache_dir())
+    parser.add_argument('--no-cache', action='store_true', help='neither read nor write the meta model cache')
+    parser.add_argument('--dump', action='append', choices=artifact_kinds,
+                        help='debug artifact to write (repeatable, default: $MANA_DUMP)')
+    parser.add_argument('--dump-dir', type=Path, help='debug artifact directory (default: $MANA_DUMP_DIR or mana-artifacts)')
+    args = parser.parse_args(argv)
+
+    if not args.jobs:
+        args.jobs = [examples_path / 'test-model.json']
+    if args.no_cache:
+        args.cache_dir = None
+    return args
+
+def main(argv=None):
+    args = arguments(argv)
+    jobs = job_paths(args.jobs, exclude=[args.meta_model])
+
     try:
         start_time()
-        mmg = MetaModelGenerator(json_job(meta_model_path))  
-        mmg.parse()
-        mmg.interpret()
-        mmg.generate()
+        dump = ArtifactWriter.from_environment(args.dump, args.dump_dir)
+        args.dump = [] if dump is None else sorted(dump.kinds)
+        args.dump_dir = None if dump is None else dump.directory
+        if args.trace_dir is not None:
+            tracing.enable()
+        artifacts = ArtifactWriter(args.dump_dir / 'meta-model', args.dump) if args.dump else None
+        mmg = MetaModelGenerator(json_job(args.meta_model), artifacts)
+        # a cache hit skips the steps that write the meta model artifacts
+        code = None if args.cache_dir is None or args.dump else mmg.cached_code(args.cache_dir)
+        if code is None:
+            mmg.parse()
+            mmg.interpret(args.workers)
+            code = mmg.generate_code(args.cache_dir)
+        if artifacts is not None:
+            artifacts.close()
+        if args.trace_dir is not None:
+            tracing.disable().write(args.trace_dir / 'meta-model.trace.json')
         print_time('Generatening meta model')
-        
-        from mana.generators.model_instantiator import ModelInstantiator
-        # By loading ModelInstantiator first now the latest genarated 
-        # meta-model will be used 
-        
-        mi = ModelInstantiator(json_job(my_model_path))
-        mi.parse()
-        mi.interpret()
-        mi.instantiate()
-        print_time('Instantiate model')
+
+        settings = {'output': args.output,
+                    'export': args.export,
+                    'statistics': args.statistics,
+                    'dump': args.dump,
+                    'dump_dir': args.dump_dir,
+                    'materialize_canthappen': args.materialize_canthappen,
+                    'database_dir': args.database_dir,
+                    'trace_dir': args.trace_dir}
+        workers = max(1, min(args.workers, len(jobs)))
+        results = run_batch(code, jobs, workers, settings, print_result)
+        print_time(f'Instantiate {len(jobs)} model(s)')
 
     except ManaException as e:
         if e.exit():
@@ -66,5 +113,9 @@ def main():
         else:
             raise e
 
+    failed = [result for result in results if not result['ok']]
+    if failed:
+        sys.exit(f'{len(failed)} of {len(results)} job(s) failed')
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,160 @@
+import json
+import marshal
+import time
+import traceback
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+from mana import footprint, population, tracing
+from mana.debug_artifacts import ArtifactWriter
+from mana.generators.meta_model_loader import MetaModelCode, load_meta_model
+from mana.generators.model_instantiator import ModelInstantiator
+from mana.jobs import json_job
+from mana.runtime import query_statistics
+from mana.warnings_and_exceptions import *
+
+# Set per worker process by init_worker
+worker_meta_model_code: Optional[MetaModelCode] = None
+worker_settings: dict = dict()
+
+
+def job_paths(inputs: Iterable[Path], exclude: Iterable[Path] = ()) -> list[Path]:
+    """ Job files, directories are expanded to the *.json files in them """
+    excluded = {Path(path).resolve() for path in exclude}
+    out = []
+    for path in inputs:
+        path = Path(path)
+        candidates = sorted(path.glob('*.json')) if path.is_dir() else [path]
+        out += [job for job in candidates if job.resolve() not in excluded]
+    return out
+
+
+def result_names(jobs: list[Path]) -> list[str]:
+    """ Unique (file system safe) result name per job, based on the job file name """
+    names = []
+    used = set()
+    for job in jobs:
+        name = job.stem
+        number = 2
+        while name in used:
+            name = f'{job.stem}-{number}'
+            number += 1
+        used.add(name)
+        names.append(name)
+    return names
+
+
+def init_worker(code_data: bytes, settings: dict):
+    """ settings: output (directory or None), export (bool), dump (list of
+    artifact kinds), dump_dir, materialize_canthappen (bool), database_dir
+    and trace_dir (directories or None) and statistics (bool) """
+    global worker_meta_model_code, worker_settings
+    worker_meta_model_code = marshal.loads(code_data)
+    worker_settings = settings
+
+
+def run_job(job_path: Path, result_name: str) -> dict:
+    """ Instantiate one job into a population of its own and write its
+    result, the returned summary is the result without any facts """
+    settings = worker_settings
+    timings: dict[str, float] = dict()
+    result = {'job': str(job_path), 'ok': False, 'instances': None, 'timings': timings, 'error': None}
+    artifacts = None
+    database = None
+    if settings.get('dump'):
+        artifacts = ArtifactWriter(Path(settings['dump_dir']) / result_name, settings['dump'])
+    if settings.get('trace_dir') is not None:
+        tracing.enable()
+
+    start = time.perf_counter()
+    step_start = start
+    def step(name: str):
+        nonlocal step_start
+        now = time.perf_counter()
+        timings[name] = now - step_start
+        step_start = now
+
+    try:
+        meta_model = load_meta_model(worker_meta_model_code)
+        if settings.get('database_dir') is not None:
+            database_path = Path(settings['database_dir']) / f'{result_name}.sqlite'
+            database_path.parent.mkdir(parents=True, exist_ok=True)
+            database_path.unlink(missing_ok=True)
+            from mana.sqlite_store import SqliteDatabase
+            database = SqliteDatabase(database_path)
+            database.attach(meta_model)
+        mi = ModelInstantiator(json_job(Path(job_path)), meta_model, artifacts,
+                               materialize_canthappen=settings.get('materialize_canthappen', False))
+        step('load')
+        mi.parse()
+        step('parse')
+        mi.interpret()
+        step('interpret')
+        mi.instantiate()
+        step('instantiate')
+        result['ok'] = True
+        result['instances'] = population.instance_count(meta_model)
+        result['handles'] = mi.handle_statistics()
+        queries = query_statistics(meta_model)
+        result['queries'] = {'hits': queries['hits'], 'misses': queries['misses']}
+        if settings.get('statistics'):
+            result['statistics'] = footprint.population_statistics(meta_model)
+        if settings.get('export'):
+            result['facts'] = population.facts(meta_model)
+    except ManaException as e:
+        result['error'] = diagnostic(e)
+    except Exception as e:
+        # an unexpected failure in one job must not stop the batch
+        result['error'] = diagnostic(e) | {'traceback': traceback.format_exc()}
+    finally:
+        if database is not None:
+            try:
+                database.close()
+            except ManaException as e:
+                # the pending rows could not be inserted, an earlier error is the cause
+                if result['error'] is None:
+                    result['ok'] = False
+                    result['error'] = diagnostic(e)
+        timings['total'] = time.perf_counter() - start
+        if artifacts is not None:
+            artifacts.close()
+        if settings.get('trace_dir') is not None:
+            tracing.disable().write(Path(settings['trace_dir']) / f'{result_name}.trace.json')
+
+    if settings.get('output') is not None:
+        output_dir = Path(settings['output'])
+        output_dir.mkdir(parents=True, exist_ok=True)
+        with open(output_dir / f'{result_name}.result.json', 'w') as result_file:
+            json.dump(result, result_file, separators=(',', ':'), default=str)
+    result.pop('facts', None)
+    result.pop('statistics', None)
+    return result
+
+
+def run_batch(meta_model_code: MetaModelCode, jobs: list[Path], workers: int, settings: dict,
+              report: Optional[Callable[[dict], None]] = None) -> list[dict]:
+    """ Run all jobs against one compiled meta model, on a pool of worker
+    processes if workers > 1. The summaries are returned in job order,
+    report is called for each summary as soon as its job is done. """
+    code_data = marshal.dumps(meta_model_code)
+    names = result_names(jobs)
+    if workers <= 1 or len(jobs) <= 1:
+        init_worker(code_data, settings)
+        results = []
+        for job, name in zip(jobs, names):
+            results.append(run_job(job, name))
+            if report is not None:
+                report(results[-1])
+        return results
+
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    results: list[dict] = [dict()] * len(jobs)
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(code_data, settings)) as pool:
+        futures = {pool.submit(run_job, job, name): index
+                   for index, (job, name) in enumerate(zip(jobs, names))}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+            if report is not None:
+                report(results[futures[future]])
+    return results
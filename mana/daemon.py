@@ -0,0 +1,310 @@
+import argparse
+import json
+import socket
+import socketserver
+import sys
+import threading
+import time
+from collections import namedtuple
+from pathlib import Path
+from typing import Optional
+
+from mana import diff, footprint, population
+from mana.generators.meta_model_generator import MetaModelGenerator
+from mana.generators.meta_model_loader import MetaModelCode, default_cache_dir, load_meta_model
+from mana.generators.model_instantiator import ModelInstantiator
+from mana.generators.parse_cache import ParseCache
+from mana.jobs import json_job, job_files
+from mana.runtime import freeze
+from mana.warnings_and_exceptions import *
+
+# The latest analysis of a job, meta_model is the instantiated population
+# (None if the analysis failed, then error holds the diagnostic)
+JobState = namedtuple('JobState', 'job meta_model error seconds finished')
+
+
+class MissingArgument(Exception):
+    """ A request without an argument its command needs """
+
+
+def file_stamps(paths) -> dict:
+    """ Modification stamp per file, None for files that can not be read """
+    stamps = dict()
+    for path in paths:
+        try:
+            stamps[path] = ParseCache.stamp(path)
+        except OSError:
+            stamps[path] = None
+    return stamps
+
+
+class AnalysisDaemon:
+    """ Keeps the generated meta model and the parsed model files warm in
+    one process, re-analyzes watched jobs when their files change and
+    answers analysis requests (see handle). """
+    def __init__(self, meta_model_job: Path, cache_dir: Optional[Path] = None, poll_interval: float = 0.5):
+        self.meta_model_job = Path(meta_model_job).resolve()
+        self.cache_dir = cache_dir
+        self.poll_interval = poll_interval
+        self.parse_cache = ParseCache()
+        self.lock = threading.RLock()
+        self.meta_model_code: Optional[MetaModelCode] = None
+        self.meta_model_error: Optional[dict] = None
+        self.meta_model_inputs: dict = dict()
+        self.jobs: dict[Path, JobState] = dict()
+        self.job_inputs: dict[Path, dict] = dict()
+        self.job_locks: dict[Path, threading.Lock] = dict()
+        # Snapshot of the population before the latest analysis, per job
+        self.previous: dict[Path, diff.Snapshot] = dict()
+        self.stopped = threading.Event()
+
+    def load_meta_model(self):
+        with self.lock:
+            self.meta_model_inputs = file_stamps(self.watched_files(self.meta_model_job))
+            try:
+                mmg = MetaModelGenerator(json_job(self.meta_model_job), parse_cache=self.parse_cache)
+                code = None if self.cache_dir is None else mmg.cached_code(self.cache_dir)
+                if code is None:
+                    mmg.parse()
+                    mmg.interpret()
+                    code = mmg.generate_code(self.cache_dir)
+                self.meta_model_code = code
+                self.meta_model_error = None
+            except Exception as e:
+                # keep serving with the previous meta model (if any)
+                self.meta_model_error = diagnostic(e)
+
+    def watched_files(self, job_path: Path) -> list[Path]:
+        try:
+            return job_files(job_path)
+        except (ManaException, OSError, ValueError):
+            return [job_path]  # watch the job file until it becomes valid
+
+    def analyze(self, job_path: Path) -> JobState:
+        job_path = Path(job_path).resolve()
+        with self.lock:
+            if self.meta_model_code is None:
+                self.load_meta_model()
+            job_lock = self.job_locks.setdefault(job_path, threading.Lock())
+        with job_lock:
+            inputs = file_stamps(self.watched_files(job_path))
+            start = time.perf_counter()
+            try:
+                if self.meta_model_code is None:
+                    raise ManaMetaModelUnavailableException(self.meta_model_job)
+                meta_model = load_meta_model(self.meta_model_code)
+                mi = ModelInstantiator(json_job(job_path), meta_model, parse_cache=self.parse_cache)
+                mi.parse()
+                mi.interpret()
+                mi.instantiate()
+                # request threads read the population concurrently
+                freeze(meta_model)
+                state = JobState(job_path, meta_model, None, time.perf_counter() - start, time.time())
+            except Exception as e:
+                # the daemon outlives any failing analysis, report it instead
+                state = JobState(job_path, None, diagnostic(e), time.perf_counter() - start, time.time())
+            with self.lock:
+                replaced = self.jobs.get(job_path)
+                if replaced is not None and replaced.meta_model is not None:
+                    self.previous[job_path] = diff.snapshot(replaced.meta_model)
+                self.jobs[job_path] = state
+                self.job_inputs[job_path] = inputs
+        return state
+
+    def poll(self):
+        """ Re-analyze the jobs with changed files, all of them if the
+        meta model changed """
+        with self.lock:
+            meta_model_changed = file_stamps(self.meta_model_inputs) != self.meta_model_inputs
+            changed_jobs = [job for job, inputs in self.job_inputs.items()
+                            if meta_model_changed or file_stamps(inputs) != inputs]
+        if meta_model_changed:
+            self.load_meta_model()
+        for job in changed_jobs:
+            self.analyze(job)
+
+    def watch(self):
+        while not self.stopped.wait(self.poll_interval):
+            self.poll()
+
+    def current(self, job_path: Path) -> Optional[JobState]:
+        """ The latest analysis of the job, None if it was never analyzed
+        (reading does not start analyzing or watching a job) """
+        with self.lock:
+            return self.jobs.get(Path(job_path).resolve())
+
+    def summary(self, state: JobState) -> dict:
+        return {'ok': state.error is None,
+                'job': str(state.job),
+                'seconds': state.seconds,
+                'finished': state.finished,
+                'instances': None if state.meta_model is None else population.instance_count(state.meta_model),
+                'error': state.error}
+
+    def handle(self, request: dict) -> dict:
+        """ One request of the json protocol, 'command' is one of:
+        instantiate (job): (re-)analyze the job and watch it from now on
+        export (job):      the population as facts (see population.facts),
+                           this and the next commands need an instantiate
+                           of the job first
+        query (job, class, where): instances matching attribute values
+        diff (job):        added, removed and modified instances per class
+                           since the analysis before the latest one
+        statistics (job):  instance counts and memory estimates (see
+                           footprint.population_statistics)
+        forget (job):      stop watching the job
+        status:            meta model state and all watched jobs
+        shutdown:          stop the daemon
+        """
+        if not isinstance(request, dict):
+            return {'ok': False, 'error': {'exception': 'BadRequest', 'message': str(request)}}
+        command = request.get('command')
+
+        def argument(name: str):
+            if name not in request:
+                raise MissingArgument(name)
+            return request[name]
+
+        try:
+            if command == 'instantiate':
+                return self.summary(self.analyze(argument('job')))
+            elif command in ['export', 'query', 'diff', 'statistics']:
+                state = self.current(argument('job'))
+                if state is None:
+                    return {'ok': False, 'error': {'exception': 'NotAnalyzed', 'message': str(argument('job'))}}
+                if state.meta_model is None:
+                    return self.summary(state)
+                if command == 'export':
+                    data = population.facts(state.meta_model)
+                elif command == 'diff':
+                    with self.lock:
+                        previous = self.previous.get(state.job, dict())
+                    data = diff.delta(previous, state.meta_model)
+                elif command == 'statistics':
+                    data = footprint.population_statistics(state.meta_model)
+                else:
+                    data = population.query(state.meta_model, argument('class'), request.get('where', {}))
+                return self.summary(state) | {'data': data}
+            elif command == 'forget':
+                with self.lock:
+                    job_path = Path(argument('job')).resolve()
+                    self.jobs.pop(job_path, None)
+                    self.job_inputs.pop(job_path, None)
+                    self.previous.pop(job_path, None)
+                    self.job_locks.pop(job_path, None)
+                return {'ok': True}
+            elif command == 'status':
+                with self.lock:
+                    states = list(self.jobs.values())
+                return {'ok': self.meta_model_error is None,
+                        'meta_model_job': str(self.meta_model_job),
+                        'error': self.meta_model_error,
+                        'parse_cache': {'hits': self.parse_cache.hits, 'misses': self.parse_cache.misses},
+                        'jobs': [self.summary(state) for state in states]}
+            elif command == 'shutdown':
+                self.stopped.set()
+                return {'ok': True}
+            return {'ok': False, 'error': {'exception': 'UnknownCommand', 'message': str(command)}}
+        except MissingArgument as e:
+            return {'ok': False, 'error': {'exception': 'MissingArgument', 'message': str(e)}}
+        except Exception as e:
+            # a malformed request (e.g. where not an object) must not kill the connection
+            return {'ok': False, 'error': diagnostic(e)}
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """ One json request per line, answered by one json response per line """
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                response = self.server.analysis.handle(request)
+            except ValueError as e:
+                response = {'ok': False, 'error': diagnostic(e)}
+            self.wfile.write(json.dumps(response, separators=(',', ':'), default=str).encode('utf-8') + b'\n')
+            self.wfile.flush()
+            if self.server.analysis.stopped.is_set():
+                threading.Thread(target=self.server.shutdown).start()
+                return
+
+
+class TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+if hasattr(socketserver, 'UnixStreamServer'):
+    class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+
+def serve(analysis: AnalysisDaemon, socket_path: Optional[Path] = None, port: Optional[int] = None):
+    """ Serve requests on a unix socket, or on localhost:port """
+    if port is not None:
+        server = TCPServer(('127.0.0.1', port), RequestHandler)
+    else:
+        socket_path = Path(socket_path)
+        if socket_path.exists():
+            socket_path.unlink()  # stale socket from an earlier daemon
+        server = UnixServer(str(socket_path), RequestHandler)
+    server.analysis = analysis
+    watcher = threading.Thread(target=analysis.watch, name='mana-watch', daemon=True)
+    watcher.start()
+    try:
+        server.serve_forever()
+    finally:
+        analysis.stopped.set()
+        server.server_close()
+        if port is None:
+            socket_path.unlink(missing_ok=True)
+
+
+def request(message: dict, socket_path: Optional[Path] = None, port: Optional[int] = None) -> dict:
+    """ Client side: send one request to a running daemon """
+    if port is not None:
+        connection = socket.create_connection(('127.0.0.1', port))
+    else:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(str(socket_path))
+    with connection, connection.makefile('rwb') as stream:
+        stream.write(json.dumps(message).encode('utf-8') + b'\n')
+        stream.flush()
+        return json.loads(stream.readline())
+
+
+def main():
+    examples_path = Path(__file__).parent / "examples"
+    parser = argparse.ArgumentParser(
+        prog='mana-daemon',
+        description='Serve model analysis requests with a warm meta model')
+    parser.add_argument('--meta-model', type=Path, default=examples_path / 'shlaer-mellor-metamodel.json',
+                        help='meta model job file')
+    parser.add_argument('--watch', type=Path, action='append', default=[],
+                        help='job file to analyze at start and on every change (repeatable)')
+    parser.add_argument('--cache-dir', type=Path, default=default_cache_dir())
+    parser.add_argument('--poll', type=float, default=0.5, help='seconds between file checks')
+    address = parser.add_mutually_exclusive_group()
+    address.add_argument('--socket', type=Path, help='unix socket path (default: mana.sock in the cache directory)')
+    address.add_argument('--port', type=int, help='serve on localhost:PORT instead of a unix socket')
+    args = parser.parse_args()
+
+    if args.port is None and args.socket is None:
+        if not hasattr(socketserver, 'UnixStreamServer'):
+            parser.error('unix sockets are not supported here, use --port')
+        args.cache_dir.mkdir(parents=True, exist_ok=True)
+        args.socket = args.cache_dir / 'mana.sock'
+
+    analysis = AnalysisDaemon(args.meta_model, args.cache_dir, args.poll)
+    analysis.load_meta_model()
+    if analysis.meta_model_error is not None:
+        print(analysis.meta_model_error['message'], file=sys.stderr)
+    for job in args.watch:
+        analysis.analyze(job)
+    print(f'mana-daemon serving on {args.socket if args.port is None else args.port}', file=sys.stderr)
+    serve(analysis, args.socket, args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import atexit
+import json
+import os
+import queue
+import sys
+import threading
+from pathlib import Path
+from typing import Any, Iterable, Optional
+from mana.warnings_and_exceptions import *
+
+# parse:     the parsed class and state models, one artifact per input file
+# interpret: the interpreted tables (classes, relations, referentials, ...)
+# types:     the type table
+# source:    the rendered meta model source
+artifact_kinds = ['parse', 'interpret', 'types', 'source']
+
+
+def plain(data: Any) -> Any:
+    """ pure function, data converted to something json can encode as is """
+    if isinstance(data, tuple) and hasattr(data, '_asdict'):
+        return {key: plain(value) for key, value in data._asdict().items()}
+    if isinstance(data, dict):
+        return {key if isinstance(key, str) else str(key): plain(value)
+                for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [plain(value) for value in data]
+    if isinstance(data, (set, frozenset)):
+        return sorted((plain(value) for value in data), key=str)
+    if data is None or isinstance(data, (str, int, float, bool)):
+        return data
+    return str(data)
+
+
+class ArtifactWriter:
+    """ Opt-in dumping of debug artifacts to a directory.
+
+    Only the selected kinds are produced. The data is encoded as compact
+    json on the calling thread (the reader keeps mutating its tables, so
+    this is the snapshot) and written to disk on a background thread.
+    """
+    def __init__(self, directory: Path, kinds: Iterable[str]):
+        self.directory = Path(directory)
+        self.kinds = set(kinds)
+        for kind in self.kinds:
+            if kind not in artifact_kinds:
+                raise ManaUnknownArtifactKindException(kind, artifact_kinds)
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_environment(cls, kinds: Optional[Iterable[str]] = None,
+                         directory: Optional[Path] = None) -> Optional['ArtifactWriter']:
+        """ $MANA_DUMP with comma separated kinds, $MANA_DUMP_DIR as directory
+        (default mana-artifacts), unless given. None if no kind is selected. """
+        if kinds is None:
+            kinds = [kind.strip() for kind in os.environ.get('MANA_DUMP', '').split(',') if kind.strip()]
+        if directory is None:
+            directory = Path(os.environ.get('MANA_DUMP_DIR', 'mana-artifacts'))
+        if not kinds:
+            return None
+        return cls(directory, kinds)
+
+    def enabled(self, kind: str) -> bool:
+        return kind in self.kinds
+
+    def dump(self, kind: str, name: str, data: Any):
+        if kind in self.kinds:
+            text = json.dumps(plain(data), separators=(',', ':'))
+            self._put(f'{name}.{kind}.json', text)
+
+    def dump_text(self, kind: str, name: str, text: str, suffix: str = 'txt'):
+        if kind in self.kinds:
+            self._put(f'{name}.{kind}.{suffix}', text)
+
+    def _put(self, file_name: str, text: str):
+        with self._lock:
+            if self._thread is None:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                self._thread = threading.Thread(
+                    target=self._write_loop, name='mana-artifact-writer', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+        self._queue.put((self.directory / file_name, text))
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            file_path, text = item
+            try:
+                with open(file_path, 'w') as artifact_file:
+                    artifact_file.write(text)
+            except OSError as e:
+                print(ManaArtifactWriteWarning(file_path, e), file=sys.stderr)
+
+    def close(self):
+        """ Wait until all artifacts are written """
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+            atexit.unregister(self.close)
@@ -0,0 +1,134 @@
+""" Derived attributes of the generated meta model classes.
+
+A derivation computes the value of a derived attribute from an instance, by
+its other attributes and navigations. It names the classes whose population
+it reads (sources) and the derived attributes it uses (derived), e.g.:
+
+    derived = DerivedAttributes(meta_model)
+
+    @derived.derivation('Class', 'Attribute count', sources=['Attribute'])
+    def attribute_count(class_i):
+        return len(meta_model.Attribute.query(class_i.R20()))
+
+Values are computed on first use and kept per instance. Instances do not
+change once created, so a value only gets stale when the population of a
+source class grows (see MetaClass.version), or of a source of a derived
+attribute it uses. Each read compares the versions of these classes with the
+ones the memoized values were computed at, and forgets the values of that
+derived attribute only if any changed. A value is also kept with the
+attribute values of its instance, so an instance deleted and created anew
+with the same identifier but other values is computed again.
+
+Changes of a source invalidate per derivation, not per instance: a
+derivation is any function, which instances of its sources it reads can not
+be known without tracking every query, and a new instance of a source can
+change the value of any instance (e.g. a count). Hence while a source population is still
+growing, e.g. during ModelInstantiator.instantiate, every new() of a source
+forgets all values of the derivation and the memo saves nothing. Read
+derived attributes once the population is complete (or frozen, see
+mana.runtime.freeze), then every value is computed once.
+"""
+from types import ModuleType
+from typing import Any, Callable, Iterable
+from mana.runtime import Constraint, MetaClass, package_class
+from mana.warnings_and_exceptions import *
+
+# (class name, attribute name), the class by model or code name
+DerivedKey = tuple[str, str]
+
+
+class Derivation:
+    def __init__(self, meta_class: type[MetaClass], attribute: str, function: Callable[[Constraint], Any],
+                 sources: list[type[MetaClass]], derived: list['Derivation']):
+        self.meta_class = meta_class
+        self.attribute = attribute
+        self.function = function
+        self.sources = sources
+        self.derived = derived
+        # set by DerivedAttributes: all classes the value depends on
+        self.closure: tuple[type[MetaClass], ...] = ()
+        self.versions: tuple[int, ...] = ()
+        # derivations using this one
+        self.dependents: list[Derivation] = []
+        # first identifier of the instance -> (its attribute values, value)
+        self.values: dict[tuple, tuple[dict, Any]] = dict()
+        self.computed = 0
+        self.hits = 0
+
+
+class DerivedAttributes:
+    def __init__(self, meta_model: ModuleType):
+        self.meta_model = meta_model
+        self.derivations: dict[tuple[type[MetaClass], str], Derivation] = dict()
+
+    def meta_class(self, class_name: str) -> type[MetaClass]:
+        return package_class(vars(self.meta_model), '_'.join(class_name.split()))
+
+    def register(self, class_name: str, attribute: str, function: Callable[[Constraint], Any],
+                 sources: Iterable[str] = (), derived: Iterable[DerivedKey] = ()):
+        meta_class = self.meta_class(class_name)
+        if (meta_class, attribute) in self.derivations:
+            raise ManaException()  # derived twice
+        used = []
+        for derived_class_name, derived_attribute in derived:
+            used_key = (self.meta_class(derived_class_name), derived_attribute)
+            if used_key not in self.derivations:
+                raise ManaException()  # register the derivations it uses first
+            used.append(self.derivations[used_key])
+        self.derivations[(meta_class, attribute)] = derivation = Derivation(
+            meta_class, attribute, function, [self.meta_class(source) for source in sources], used)
+
+        # a derivation only uses derivations registered before, hence the
+        # dependency graph has no cycles and their closures are complete
+        closure = dict.fromkeys(derivation.sources)
+        for used_derivation in used:
+            closure.update(dict.fromkeys(used_derivation.closure))
+            used_derivation.dependents.append(derivation)
+        derivation.closure = tuple(closure)
+        derivation.versions = tuple(source.version for source in derivation.closure)
+
+    def derivation(self, class_name: str, attribute: str, sources: Iterable[str] = (),
+                   derived: Iterable[DerivedKey] = ()) -> Callable:
+        """ register as decorator """
+        def decorator(function: Callable[[Constraint], Any]) -> Callable[[Constraint], Any]:
+            self.register(class_name, attribute, function, sources, derived)
+            return function
+        return decorator
+
+    def value(self, instance: Constraint, attribute: str) -> Any:
+        """ The value of a derived or of a stored attribute of instance """
+        meta_class = instance.meta_class
+        derivation = self.derivations.get((meta_class, attribute))
+        if derivation is None:
+            return instance[attribute]
+
+        versions = tuple(source.version for source in derivation.closure)
+        if versions != derivation.versions:
+            derivation.values.clear()
+            derivation.versions = versions
+        key = instance.to_key(meta_class.id_lists[0])
+        values = derivation.values
+        entry = values.get(key)
+        # the identifier may be reused by a new instance after a delete
+        if entry is not None and (entry[0] is instance.data or entry[0] == instance.data):
+            derivation.hits += 1
+            return entry[1]
+        derivation.computed += 1
+        value = derivation.function(instance)
+        values[key] = (instance.data, value)
+        return value
+
+    def invalidate(self, class_name: str, attribute: str):
+        """ Forget the values of a derived attribute and of the ones using
+        it, for derivations that read state besides the population """
+        pending = [self.derivations[(self.meta_class(class_name), attribute)]]
+        while pending:
+            derivation = pending.pop()
+            derivation.values.clear()
+            pending += derivation.dependents
+
+    def statistics(self) -> dict[str, dict]:
+        return {f'{meta_class.__name__}.{attribute}': {'values': len(derivation.values),
+                                                       'computed': derivation.computed,
+                                                       'hits': derivation.hits}
+                for (meta_class, attribute), derivation in self.derivations.items()}
@@ -0,0 +1,94 @@
+""" Change detection between populations of a meta model.
+
+A snapshot keeps per generated class its attribute list and a content digest
+per instance, by the instance's first identifier. Comparing a snapshot with a
+population only looks up identifiers, instances are never compared pairwise:
+
+added:    identifier not in the snapshot
+removed:  identifier in the snapshot only
+modified: identifier in both, other digest (or other attribute list)
+"""
+import hashlib
+import json
+from pathlib import Path
+from types import ModuleType
+from typing import Iterator
+from mana.population import from_json_value
+from mana.runtime import MetaClass, loaded_classes
+
+# class name -> {'attributes': attr_list, 'instances': {identifier: digest}}
+Snapshot = dict[str, dict]
+
+# A change: (kind, class name, row), the row is the identifier for removed
+Change = tuple[str, str, tuple]
+
+
+def digest(row: tuple) -> str:
+    """ pure function, unlike hash() the same in every process """
+    return hashlib.blake2b(repr(row).encode('utf-8'), digest_size=12).hexdigest()
+
+
+def instance_rows(_class: type[MetaClass]) -> Iterator[tuple[tuple, tuple]]:
+    """ (identifier, attribute values in attr_list order) per instance """
+    attr_list = _class.attr_list
+    for key, instance in _class.store.items():
+        data = instance.data
+        yield key, tuple([data[attr] for attr in attr_list])
+
+
+def snapshot(meta_model: ModuleType) -> Snapshot:
+    return {class_name: {'attributes': list(_class.attr_list),
+                         'instances': {key: digest(row) for key, row in instance_rows(_class)}}
+            for class_name, _class in loaded_classes(meta_model).items()}
+
+
+def changes(old: Snapshot, meta_model: ModuleType) -> Iterator[Change]:
+    """ The changes from old to the population, class by class """
+    classes = loaded_classes(meta_model)
+    for class_name, _class in classes.items():
+        old_class = old.get(class_name, {'attributes': None, 'instances': {}})
+        old_instances = old_class['instances']
+        same_attributes = old_class['attributes'] == list(_class.attr_list)
+        for key, row in instance_rows(_class):
+            old_digest = old_instances.get(key)
+            if old_digest is None:
+                yield 'added', class_name, row
+            elif not same_attributes or old_digest != digest(row):
+                yield 'modified', class_name, row
+        store = _class.store
+        for key in old_instances:
+            if not store.contains(0, key):
+                yield 'removed', class_name, key
+
+    # classes of subsystems that are not loaded (anymore) have no instances
+    for class_name, old_class in old.items():
+        if class_name not in classes:
+            for key in old_class['instances']:
+                yield 'removed', class_name, key
+
+
+def delta(old: Snapshot, meta_model: ModuleType) -> dict[str, dict]:
+    """ The changes per class with any, rows in the same format as facts """
+    out = dict()
+    for kind, class_name, row in changes(old, meta_model):
+        if class_name not in out:
+            out[class_name] = {'added': [], 'removed': [], 'modified': []}
+        out[class_name][kind].append(list(row))
+    return out
+
+
+def save_snapshot(snapshot: Snapshot, path: Path):
+    with open(path, 'w') as snapshot_file:
+        json.dump({class_name: {'attributes': class_snapshot['attributes'],
+                                'instances': list(class_snapshot['instances'].items())}
+                   for class_name, class_snapshot in snapshot.items()},
+                  snapshot_file, separators=(',', ':'))
+
+
+def load_snapshot(path: Path) -> Snapshot:
+    with open(path) as snapshot_file:
+        data = json.load(snapshot_file)
+    return {class_name: {'attributes': class_snapshot['attributes'],
+                         'instances': {from_json_value(key): instance_digest
+                                       for key, instance_digest in class_snapshot['instances']}}
+            for class_name, class_snapshot in data.items()}
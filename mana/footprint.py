@@ -0,0 +1,140 @@
+""" Size of a population of a meta model: instance counts, identifier table
+and index sizes and the estimated bytes the population retains, per class
+and rolled up per subsystem and per domain of the instances.
+
+Bytes are sys.getsizeof summed over the objects reachable from a class's
+instances, identifier tables and indexes. Every object is counted once, by
+the first class (in subsystem order) that reaches it. Strings are counted
+once per value, as if equal strings were one object, so the numbers do not
+depend on which strings happened to be interned.
+
+Only what is in memory is counted, for a SqliteStore that is the rows not
+inserted yet.
+"""
+import gc
+import sys
+from collections import deque
+from types import MappingProxyType, ModuleType
+from typing import Any, Mapping, Optional
+from mana.runtime import Constraint, DictStore, FrozenStore, MetaClass, OverlayStore, loaded_classes
+
+containers = (list, tuple, set, frozenset, deque)
+
+
+class Accounting:
+    """ Objects and string values counted so far """
+    def __init__(self):
+        self.seen: set[int] = set()
+        self.strings: set[str] = set()
+        self.string_bytes = 0
+
+    def size(self, *roots: Any) -> int:
+        """ The bytes of the objects reachable from roots not counted yet """
+        total = 0
+        pending = list(roots)
+        while pending:
+            obj = pending.pop()
+            if type(obj) is str:
+                if obj not in self.strings:
+                    self.strings.add(obj)
+                    size = sys.getsizeof(obj)
+                    self.string_bytes += size
+                    total += size
+                continue
+            if id(obj) in self.seen:
+                continue
+            self.seen.add(id(obj))
+            total += sys.getsizeof(obj)
+            if isinstance(obj, Constraint):
+                pending.append(obj.data)
+            elif isinstance(obj, dict):
+                pending += obj.keys()
+                pending += obj.values()
+            elif isinstance(obj, containers):
+                pending += obj
+            elif isinstance(obj, MappingProxyType):
+                pending += gc.get_referents(obj)  # the mapping it is a view of
+        return total
+
+
+def store_tables(store: Any) -> tuple[tuple[Mapping, ...], list]:
+    """ The in-memory identifier tables of a store and its other containers
+    (the identifiers removed from a fork, the instance tuple of a frozen
+    class, the rows a SqliteStore did not insert yet) """
+    if isinstance(store, OverlayStore):
+        return store.added.tables, list(store.removed)
+    if isinstance(store, FrozenStore):
+        return store.tables, [store.instances]
+    if isinstance(store, DictStore):
+        return store.tables, []
+    return getattr(store, 'pending_keys', ()), [getattr(store, 'pending_rows', [])]
+
+
+def domain_attribute(_class: type[MetaClass]) -> Optional[str]:
+    """ The attribute holding the domain name of an instance, if any """
+    if 'Domain' in _class.attr_set:
+        return 'Domain'
+    if _class.__name__ == 'Domain' or 'Domain' in _class.supertypes.values():
+        return 'Name'
+    return None
+
+
+def class_statistics(_class: type[MetaClass], accounting: Accounting, domains: dict[str, dict]) -> dict:
+    tables, others = store_tables(_class.store)
+    attribute = domain_attribute(_class)
+
+    # instances first, so the tables and indexes only add their own structure
+    sizes = {key: accounting.size(instance) for key, instance in (tables[0].items() if tables else ())}
+    instance_bytes = sum(sizes.values())
+    if attribute is not None:
+        # also the instances that are not in memory, of a fork's parent or a database
+        for key, instance in _class.store.items():
+            domain = domains.setdefault(instance.data[attribute], {'classes': set(), 'instances': 0, 'bytes': 0})
+            domain['classes'].add(_class.__name__)
+            domain['instances'] += 1
+            domain['bytes'] += sizes.get(key, 0)
+
+    identifiers = [{'attributes': list(id_list),
+                    'entries': len(table),
+                    'bytes': accounting.size(table)}
+                   for id_list, table in zip(_class.id_lists, tables)]
+    indexes = {'ordinal': accounting.size(*[index.groups for index in _class.ordinal_indexes.values()]),
+               'subtype': accounting.size(*[index.instances for index in _class.subtype_indexes.values()]),
+               'query cache': accounting.size(_class.query_cache)}
+    other_bytes = accounting.size(*others)
+    return {'instances': len(_class.store),
+            'identifiers': identifiers,
+            'indexes': indexes,
+            'instance_bytes': instance_bytes,
+            'bytes': (instance_bytes + sum(identifier['bytes'] for identifier in identifiers)
+                      + sum(indexes.values()) + other_bytes)}
+
+
+def population_statistics(meta_model: ModuleType) -> dict:
+    """ The statistics of the loaded classes (classes of subsystems that are
+    not loaded have no instances), JSON serializable. The domain roll-ups
+    only hold the instances and their bytes, tables and indexes are shared
+    by the domains. Reads every instance, call it after instantiate and not
+    per request. """
+    accounting = Accounting()
+    classes = dict()
+    subsystems = dict()
+    domains = dict()
+    loaded = loaded_classes(meta_model)
+    for subsystem in meta_model.loaded_subsystems:
+        rollup = subsystems[subsystem] = {'classes': 0, 'instances': 0, 'bytes': 0}
+        for class_name in meta_model.subsystem_class_names[subsystem]:
+            statistics = classes[class_name] = class_statistics(loaded[class_name], accounting, domains)
+            statistics['subsystem'] = subsystem
+            rollup['classes'] += 1
+            rollup['instances'] += statistics['instances']
+            rollup['bytes'] += statistics['bytes']
+
+    return {'meta_model': meta_model.domain,
+            'instances': sum(rollup['instances'] for rollup in subsystems.values()),
+            'bytes': sum(rollup['bytes'] for rollup in subsystems.values()),
+            'strings': {'distinct': len(accounting.strings), 'bytes': accounting.string_bytes},
+            'classes': classes,
+            'subsystems': subsystems,
+            'domains': {domain: rollup | {'classes': sorted(rollup['classes'])}
+                        for domain, rollup in domains.items()}}
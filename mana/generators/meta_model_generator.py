@@ -1,12 +1,47 @@
-import pprint
+import os
 import sys
 from pathlib import Path
+from types import ModuleType
+from typing import Optional
+import mana
+from mana.debug_artifacts import ArtifactWriter
+from mana.generators.parse_cache import ParseCache
 from mana.generators.model_reader import ModelReader 
-from jinja2 import Environment, FileSystemLoader
+from mana.tracing import span
+from mana.generators.meta_model_loader import (compile_meta_model, load_meta_model,
+    input_digest, store_cache_key, load_cached_code, MetaModelCode, MetaModelSources, root_module)
+
+template_path = Path(__file__).parent.parent / 'templates'
+template_name = 'meta_model.py.jinja'
+subsystem_template_name = 'meta_model_subsystem.py.jinja'
+
+# One jinja2 environment per bytecode cache directory, created on first use
+# hence jinja2 is only imported when a meta model actually is rendered
+environments: dict = dict()
+
+def template_environment(cache_dir: Optional[Path] = None):
+    if cache_dir not in environments:
+        from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
+        bytecode_cache = None
+        if cache_dir is not None:
+            jinja_cache_dir = Path(cache_dir) / 'jinja'
+            try:
+                jinja_cache_dir.mkdir(parents=True, exist_ok=True)
+                # jinja raises on writing to an existing read-only directory
+                if os.access(jinja_cache_dir, os.W_OK):
+                    bytecode_cache = FileSystemBytecodeCache(str(jinja_cache_dir))
+            except OSError:
+                pass  # e.g. a read-only file system, compile the templates every run
+        environments[cache_dir] = Environment(
+            loader=FileSystemLoader(template_path), 
+            bytecode_cache=bytecode_cache,
+            trim_blocks=True, lstrip_blocks= True, extensions=['jinja2.ext.do'])
+    return environments[cache_dir]
     
 class MetaModelGenerator(ModelReader):
-    def __init__(self, jobs: dict):
-        ModelReader.__init__(self, jobs)
+    def __init__(self, jobs: dict, artifacts: Optional[ArtifactWriter] = None, 
+                 parse_cache: Optional[ParseCache] = None):
+        ModelReader.__init__(self, jobs, artifacts, parse_cache)
     
     def code_name(self, name : str):
         """ pure function """
@@ -16,22 +51,71 @@ class MetaModelGenerator(ModelReader):
         """ pure function """
         return self.code_name(name).lower()
         
-    def generate(self):
-        
-        #template_file_name = "templates/meta_model.py.jinja"
-        #template_file = Path(__file__).parent.parent / template_file_name
-        file_loader = FileSystemLoader( Path(__file__).parent.parent / 'templates')
-        env = Environment(loader=file_loader, trim_blocks=True, lstrip_blocks= True, extensions=['jinja2.ext.do'])
-        env.globals['code_name'] = lambda name : self.code_name(name)
-        env.globals['symb_name'] = lambda name : self.symb_name(name)
-        env.globals['id'] = lambda _class : self.id(_class)
-        env.globals['referential'] = lambda _class : self.referential(_class)
-
-        template = env.get_template('meta_model.py.jinja')
-        
-        
-        output = template.render({'subsystems':  self.subsystems, 
-                                  'domain' : self.subsystems[0].name['domain_name']})
-        with open("meta_model.py", "w") as text_file:
-            text_file.write(output)
-        
\ No newline at end of file
+    def job_key(self) -> str:
+        """ Cache key from the job input files, the template, the
+        interpreting code and the mana version """
+        generator_files = [template_path / template_name, 
+                           template_path / subsystem_template_name,
+                           Path(__file__), 
+                           Path(sys.modules[ModelReader.__module__].__file__)]
+        return input_digest(
+            list(self.jobs['subsystems']) + list(self.jobs['statemodels']) + generator_files,
+            mana.version.encode('utf-8'))
+
+    def render(self, cache_dir: Optional[Path] = None) -> MetaModelSources:
+        """ The root module and one module per subsystem, see
+        mana.runtime.subsystem_loader """
+        environment = template_environment(cache_dir)
+        context = {'subsystems':  self.subsystems, 
+                   'domain' : self.subsystems[0].name['domain_name'],
+                   'code_name' : self.code_name,
+                   'symb_name' : self.symb_name,
+                   'id' : self.id,
+                   'referential' : self.referential,
+                   'ordinal' : self.ordinal,
+                   'generalization' : self.generalization}
+
+        with span('render', root_module):
+            sources = {root_module: environment.get_template(template_name).render(context)}
+        subsystem_template = environment.get_template(subsystem_template_name)
+        for subsystem in self.subsystems:
+            module_name = self.symb_name(subsystem.name['subsys_name'])
+            with span('render', module_name):
+                sources[module_name] = subsystem_template.render(context | {'subsystem': subsystem})
+        return sources
+
+    def generate_code(self, cache_dir: Optional[Path] = None) -> MetaModelCode:
+        """ Render the meta model and compile it, see generate """
+        sources = self.render(cache_dir)
+        if self.artifact_enabled('source'):
+            for module_name, source in sources.items():
+                name = 'meta_model' if module_name == root_module else f'meta_model.{module_name}'
+                self.artifacts.dump_text('source', self.artifact_name(name), source, 'py')
+        code = compile_meta_model(sources, cache_dir)
+        if cache_dir is not None:
+            store_cache_key(cache_dir, self.job_key(), sources)
+        return code
+
+    def generate(self, cache_dir: Optional[Path] = None) -> ModuleType:
+        """ Render the meta model and compile it straight into a module object,
+        its subsystem modules are loaded on first use.
+
+        Nothing is written to the working directory. With cache_dir the
+        compiled code is cached keyed by a hash of the rendered source, and
+        can later be found from the job by cached() without parsing.
+        """
+        return load_meta_model(self.generate_code(cache_dir))
+
+    def cached_code(self, cache_dir: Path) -> Optional[MetaModelCode]:
+        """ The code from an earlier generate() of an identical job, without 
+        parsing, interpreting or rendering. None on a cache miss. """
+        try:
+            key = self.job_key()
+        except OSError:
+            return None
+        return load_cached_code(cache_dir, key)
+
+    def cached(self, cache_dir: Path) -> Optional[ModuleType]:
+        """ See cached_code """
+        code = self.cached_code(cache_dir)
+        return None if code is None else load_meta_model(code)
@@ -0,0 +1,161 @@
+import hashlib
+import linecache
+import marshal
+import os
+import sys
+import threading
+from pathlib import Path
+from types import CodeType, ModuleType
+from typing import Iterable, Optional
+from mana.runtime import OverlayStore, loaded_classes, package_class, use_store
+
+# Compiled meta model, code per module: root_module is the package module,
+# the others are the subsystem modules it loads on demand
+MetaModelCode = dict[str, CodeType]
+MetaModelSources = dict[str, str]
+root_module = '__init__'
+
+
+def default_cache_dir() -> Path:
+    """ $MANA_CACHE_DIR, else mana in the user cache directory """
+    if 'MANA_CACHE_DIR' in os.environ:
+        return Path(os.environ['MANA_CACHE_DIR'])
+    xdg_cache_home = os.environ.get('XDG_CACHE_HOME')
+    base = Path(xdg_cache_home) if xdg_cache_home else Path.home() / '.cache'
+    return base / 'mana'
+
+
+def source_digest(sources: MetaModelSources) -> str:
+    """ pure function """
+    digest = hashlib.sha256()
+    for module, source in sorted(sources.items()):
+        digest.update(module.encode('utf-8') + b'\0' + source.encode('utf-8') + b'\0')
+    return digest.hexdigest()
+
+
+def input_digest(paths: Iterable[Path], *extra: bytes) -> str:
+    """ Hash of the content of all input files (and extra data) in order """
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(str(path).encode('utf-8') + b'\0')
+        with open(path, 'rb') as input_file:
+            digest.update(hashlib.sha256(input_file.read()).digest())
+    for data in extra:
+        digest.update(data)
+    return digest.hexdigest()
+
+
+def _code_file(cache_dir: Path, digest: str) -> Path:
+    return cache_dir / f'meta_model-{digest}.{sys.implementation.cache_tag}.bin'
+
+
+def _key_file(cache_dir: Path, key: str) -> Path:
+    return cache_dir / f'job-{key}.ref'
+
+
+def _read_code(path: Path) -> Optional[MetaModelCode]:
+    try:
+        with open(path, 'rb') as code_file:
+            code = marshal.load(code_file)
+        if (isinstance(code, dict) and root_module in code
+                and all(isinstance(module_code, CodeType) for module_code in code.values())):
+            return code
+    except (OSError, EOFError, ValueError, TypeError):
+        pass  # no valid cache entry
+    return None
+
+
+def _write_atomic(path: Path, data: bytes):
+    """ Write to a temporary name and rename, hence concurrent writers
+    never expose a half written file. Failing is ok, a cache is only an
+    optimization (e.g. on a read-only file system). """
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(
+            f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        with open(tmp_path, 'wb') as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+
+def compile_meta_model(sources: MetaModelSources, cache_dir: Optional[Path] = None) -> MetaModelCode:
+    """ Compile the rendered meta model modules into code objects.
+
+    If cache_dir is given the code objects are cached there, keyed by a
+    hash of the sources.
+    """
+    digest = source_digest(sources)
+    file_names = {module: f'<meta_model {digest[:12]} {module}>' for module in sources}
+    # Register the sources so tracebacks into the generated code show lines
+    for module, source in sources.items():
+        linecache.cache[file_names[module]] = (
+            len(source), None, source.splitlines(True), file_names[module])
+
+    def compile_all() -> MetaModelCode:
+        return {module: compile(source, file_names[module], 'exec')
+                for module, source in sources.items()}
+
+    if cache_dir is None:
+        return compile_all()
+
+    code_file = _code_file(Path(cache_dir), digest)
+    code = _read_code(code_file)
+    if code is None:
+        code = compile_all()
+        _write_atomic(code_file, marshal.dumps(code))
+    return code
+
+
+def store_cache_key(cache_dir: Path, key: str, sources: MetaModelSources):
+    """ Let key (e.g. an input_digest) refer to the cached code of sources """
+    _write_atomic(_key_file(Path(cache_dir), key),
+                  source_digest(sources).encode('ascii'))
+
+
+def load_cached_code(cache_dir: Path, key: str) -> Optional[MetaModelCode]:
+    """ Code stored under key by store_cache_key, None on a cache miss """
+    try:
+        with open(_key_file(Path(cache_dir), key), 'rb') as key_file:
+            digest = key_file.read().decode('ascii')
+    except (OSError, UnicodeDecodeError):
+        return None
+    return _read_code(_code_file(Path(cache_dir), digest))
+
+
+def load_meta_model(code: MetaModelCode, name: str = 'meta_model') -> ModuleType:
+    """ Execute the compiled root module into a new module object, the
+    subsystem modules are executed on first access to one of their classes
+    (see mana.runtime.subsystem_loader).
+
+    Each call gives a fresh module, hence a population of its own. The
+    module is not registered in sys.modules.
+    """
+    module = ModuleType(name)
+    module.meta_model_code = code
+    module.subsystem_code = {module_name: module_code for module_name, module_code in code.items()
+                             if module_name != root_module}
+    exec(code[root_module], module.__dict__)
+    return module
+
+
+def fork_population(meta_model: ModuleType, name: Optional[str] = None) -> ModuleType:
+    """ A copy-on-write fork of the population of meta_model: a fresh load
+    of the same code, its classes read through to the parent's stores and
+    keep only their own changes (see mana.runtime.OverlayStore). Forking
+    costs the same for any population size, it loads the subsystems the
+    parent has loaded. The parent must not change once forked, its classes
+    (also the ones loaded later) are marked forked and new or delete on them
+    raises ManaException. Forks of forks are fine. """
+    parent = vars(meta_model)
+    meta_model.forked = True
+    for _class in loaded_classes(meta_model).values():
+        _class.forked = True
+    fork = load_meta_model(meta_model.meta_model_code, meta_model.__name__ if name is None else name)
+    use_store(fork, lambda meta_class: OverlayStore(meta_class, package_class(parent, meta_class.__name__).store))
+    # the subsystems with a population in the parent
+    for subsystem in list(meta_model.loaded_subsystems):
+        for class_name in fork.subsystem_class_names[subsystem][:1]:
+            package_class(vars(fork), class_name)
+    return fork
@@ -1,13 +1,19 @@
+from __future__ import annotations
 import pprint
 import sys
-import meta_model as MM
-from typing import TypeVar, Optional
+from types import ModuleType
+from typing import Any, Callable, TypeVar, Optional, TYPE_CHECKING
 from pathlib import Path
 from mana.generators.model_reader import ModelReader, StateBlock, EventSpec, StateTransition
-from flatland.input.statemodel_parser import StateModel
-from flatland.input.statemodel_visitor import Parameter
+from mana.debug_artifacts import ArtifactWriter
+from mana.generators.parse_cache import ParseCache
+from mana.tracing import span
 from mana.warnings_and_exceptions import *
 
+if TYPE_CHECKING:
+    from flatland.input.statemodel_parser import StateModel
+    from flatland.input.statemodel_visitor import Parameter
+
 T = TypeVar('T')
 
 def exactly_one(my_list : list[T]) -> T:
@@ -16,8 +22,20 @@ def exactly_one(my_list : list[T]) -> T:
     return my_list[0]
     
 class ModelInstantiator(ModelReader):
-    def __init__(self, jobs: dict):
-        ModelReader.__init__(self, jobs)
+    def __init__(self, jobs: dict, meta_model: ModuleType, artifacts: Optional[ArtifactWriter] = None, 
+                 parse_cache: Optional[ParseCache] = None, materialize_canthappen: bool = False):
+        ModelReader.__init__(self, jobs, artifacts, parse_cache)
+        # The generated meta model (see MetaModelGenerator.generate), it
+        # holds the population hence each instantiator should have its own
+        self.MM = meta_model
+        # Only explicit event responses are instantiated unless the implicit
+        # "can't happen" responses are asked for
+        self.materialize_canthappen = materialize_canthappen
+        # Instances by (domain, kind, name), registered as they are created
+        # so the query_* helpers need not search the population
+        self.handles: dict[tuple, Any] = dict()
+        self.handle_hits = 0
+        self.handle_misses = 0
     
     def code_name(self, name : str):
         """ pure function """
@@ -35,10 +53,33 @@ class ModelInstantiator(ModelReader):
         else:
             raise ManaException()
     
+    def register(self, domain: Optional[str], kind: str, name: Any, instance: T) -> T:
+        self.handles[(domain, kind, name)] = instance
+        return instance
+
+    def handle(self, domain: Optional[str], kind: str, name: Any, lookup: Callable[[], T]) -> T:
+        """ The registered instance, else the result of lookup (registered
+        from then on) """
+        key = (domain, kind, name)
+        instance = self.handles.get(key)
+        if instance is not None:
+            self.handle_hits += 1
+            return instance
+        self.handle_misses += 1
+        instance = lookup()
+        self.handles[key] = instance
+        return instance
+
+    def handle_statistics(self) -> dict:
+        return {'handles': len(self.handles),
+                'hits': self.handle_hits,
+                'misses': self.handle_misses}
+
     def instantiate(self):
         domains = dict()
         
-        self.instantiate_types()
+        with span('instantiate', 'types'):
+            self.instantiate_types()
         
         for subsystem in self.subsystems:
             domain = subsystem.name['domain_name']
@@ -57,67 +98,103 @@ class ModelInstantiator(ModelReader):
             self.instantiate_domain(domain, data['subsystems'], data['statemodels'])
                 
     def instantiate_domain(self, domain_name: str, subsystem_list: list, state_model_list: list):
+        MM = self.MM
         domain_attr = MM.Domain.constraint(
             {'Name' : domain_name, 
              'Alias' : domain_name})  #ToDo: fix alias to domain
         domain_i = MM.Domain.new(domain_attr)
         modeled_domain_i = MM.Modeled_Domain.new(domain_i.R4('Modeled Domain'))
         for subsystem in subsystem_list:
-            self.instantiate_subsystem(subsystem, modeled_domain_i)
+            with span('instantiate subsystem', subsystem.name['subsys_name']):
+                self.instantiate_subsystem(subsystem, modeled_domain_i)
         
         for subsystem in subsystem_list:
             subsystem_i = self.query_subsystem(
                 modeled_domain_i, subsystem.name['subsys_name'])
             for _class in subsystem.classes:
-                self.instantiate_class(_class, subsystem_i, modeled_domain_i)
+                with span('instantiate class', _class['name']):
+                    self.instantiate_class(_class, subsystem_i, modeled_domain_i)
         
         for subsystem in subsystem_list:
             subsystem_i = self.query_subsystem(
                 modeled_domain_i, subsystem.name['subsys_name'])
             for rel in subsystem.rels:
-                self.instantiate_rel(rel, subsystem_i, modeled_domain_i)
+                with span('instantiate relationship', rel['rnum']):
+                    self.instantiate_rel(rel, subsystem_i, modeled_domain_i)
         
         for state_model in state_model_list:        
-            self.instantiate_state_model(state_model, modeled_domain_i)
+            with span('instantiate state model', state_model.lifecycle['class'] if state_model.lifecycle
+                      else state_model.assigner['rel']):
+                self.instantiate_state_model(state_model, modeled_domain_i)
                 
         
     def query_subsystem(self, modeled_domain_i: MM.Modeled_Domain.constraint, subsystem_name : str) -> MM.Subsystem.constraint:
-        domain_partition_i_set = MM.Domain_Partition.query(modeled_domain_i.R3())
-        subsystem_attr = MM.Subsystem.constraint({
-            'Name' : subsystem_name})
-        for domain_partition_i in MM.Domain_Partition.query(modeled_domain_i.R3()):
-            subsystem_i_set = MM.Subsystem.query(subsystem_attr & domain_partition_i.R1())
-            if len(subsystem_i_set) == 1:
-                return exactly_one(subsystem_i_set)
-        raise ManaException()
+        MM = self.MM
+
+        def lookup():
+            subsystem_attr = MM.Subsystem.constraint({
+                'Name' : subsystem_name})
+            for domain_partition_i in MM.Domain_Partition.query(modeled_domain_i.R3()):
+                subsystem_i_set = MM.Subsystem.query(subsystem_attr & domain_partition_i.R1())
+                if len(subsystem_i_set) == 1:
+                    return exactly_one(subsystem_i_set)
+            raise ManaException()
+        return self.handle(modeled_domain_i['Name'], 'subsystem', subsystem_name, lookup)
     
     def query_class(self, modeled_domain_i: MM.Modeled_Domain.constraint, class_name : str) -> MM.Class.constraint:
+        MM = self.MM
         domain_name = MM.Modeled_Domain.value(modeled_domain_i, 'Name')
-        class_attr = MM.Class.constraint({
-            'Name' : class_name,
-            'Domain' : domain_name})
-        return exactly_one(MM.Class.query(class_attr))
+
+        def lookup():
+            class_attr = MM.Class.constraint({
+                'Name' : class_name,
+                'Domain' : domain_name})
+            return exactly_one(MM.Class.query(class_attr))
+        return self.handle(domain_name, 'class', class_name, lookup)
     
+    def query_attribute(self, class_i: MM.Class.constraint, attribute_name: str) -> MM.Attribute.constraint:
+        MM = self.MM
+
+        def lookup():
+            attribute_attr = MM.Attribute.constraint({'Name' : attribute_name})
+            return exactly_one(MM.Attribute.query(attribute_attr & class_i.R20()))
+        return self.handle(class_i['Domain'], 'attribute', (class_i['Name'], attribute_name), lookup)
+
+    def query_type(self, type_name: str) -> MM.Type.constraint:
+        MM = self.MM
+
+        def lookup():
+            return exactly_one(MM.Type.query(MM.Type.constraint({'Name' : type_name})))
+        return self.handle(None, 'type', type_name, lookup)
+
     def query_state(self,
                     state_model_i: MM.State_Model.constraint,
                     state_name: str) -> MM.State.constraint:
-        
-        state_attr = MM.State.constraint(
-            {'Name': state_name,
-             'State model':state_model_i['Name'],
-             'Domain':state_model_i['Domain']})
-        return exactly_one(MM.State.query(state_attr))
+        MM = self.MM
+        
+        def lookup():
+            state_attr = MM.State.constraint(
+                {'Name': state_name,
+                 'State model':state_model_i['Name'],
+                 'Domain':state_model_i['Domain']})
+            return exactly_one(MM.State.query(state_attr))
+        return self.handle(state_model_i['Domain'], 'state', (state_model_i['Name'], state_name), lookup)
     
     def rnum_number(self, rnum: str) -> tuple[str, int]:
         return ('R', int(rnum[1:] if rnum[0] == 'R' else rnum[2:]))
     
     def query_relationship(self, modeled_domain_i: MM.Modeled_Domain.constraint, rnum : str) -> MM.Relationship.constraint:
-        relationship_attr = MM.Relationship.constraint(
-            { 'Rnum' : self.rnum_number(rnum),
-             'Domain' : modeled_domain_i['Name']})
-        return  exactly_one(MM.Relationship.query(relationship_attr))
+        MM = self.MM
+
+        def lookup():
+            relationship_attr = MM.Relationship.constraint(
+                { 'Rnum' : self.rnum_number(rnum),
+                 'Domain' : modeled_domain_i['Name']})
+            return exactly_one(MM.Relationship.query(relationship_attr))
+        return self.handle(modeled_domain_i['Name'], 'relationship', self.rnum_number(rnum), lookup)
     
     def instantiate_subsystem(self, subsystem, modeled_domain_i: MM.Modeled_Domain.constraint):
+        MM = self.MM
         
         min_num = min([int(''.join([ d for d in rel['rnum'] if d.isdigit()])) for rel in subsystem.rels ])        
         domain_partition_attr = MM.Domain_Partition.constraint(
@@ -131,8 +208,10 @@ class ModelInstantiator(ModelReader):
             {'Name' : name,
              'Alias' : name if alias is None else alias})
         subsystem_i = MM.Subsystem.new(subsystem_attr & domain_partition_i.R1())
+        self.register(modeled_domain_i['Name'], 'subsystem', name, subsystem_i)
         
     def instantiate_class(self, _class: dict, subsystem_i: MM.Subsystem.constraint, modeled_domain_i: MM.Modeled_Domain.constraint):
+        MM = self.MM
         
         element_attr = MM.Element.constraint({'Number' : ('C', _class['cnum'])})
         element_i = MM.Element.new(element_attr & modeled_domain_i.R15())
@@ -142,6 +221,7 @@ class ModelInstantiator(ModelReader):
         class_attr = MM.Class.constraint(
             {'Name' : _class['name']})
         class_i = MM.Class.new(class_attr & subsystem_element_i.R14('Class'))
+        self.register(class_i['Domain'], 'class', _class['name'], class_i)
         for attribute in _class['attributes']:
             self.instantiate_attribute(attribute, class_i)
         
@@ -151,19 +231,21 @@ class ModelInstantiator(ModelReader):
             
     
     def instantiate_attribute(self, attribute: dict, class_i: MM.Class.constraint):
+        MM = self.MM
 
         variant = 'type' if 'type' in attribute else 'union_type'
         type_name = self.type_name(variant, attribute[variant])
-        type_attr = MM.Type.constraint({'Name' : type_name})
-        type_i = exactly_one(MM.Type.query(type_attr))
+        type_i = self.query_type(type_name)
         
         attribute_attr = MM.Attribute.constraint(
             {'Name' : attribute['name']})
         attribute_i = MM.Attribute.new(attribute_attr & class_i.R20() & type_i.R24())
+        self.register(class_i['Domain'], 'attribute', (class_i['Name'], attribute['name']), attribute_i)
         
         MM.Non_Derived_Attribute.new(attribute_i.R25('Non Derived Attribute'))
         
     def instantiate_id(self, _id: str, Attribute_list: list, class_i: MM.Class.constraint):
+        MM = self.MM
         number = {'I' : 1, 'I2' : 2, 'I3' :3}[_id]
         identifier_attr = MM.Identifier.constraint(
             {'Number' : ('I', number)})
@@ -171,29 +253,29 @@ class ModelInstantiator(ModelReader):
         
         MM.Irreducible_Identifier.new(class_i.R31() & identifier_i.R30('Irreducible Identifier'))
         for attribute_name in Attribute_list:
-            
-            attribute_attr = MM.Attribute.constraint(
-                {'Name' : attribute_name})
-            attribute_i = exactly_one(MM.Attribute.query(attribute_attr & class_i.R20()))
+            attribute_i = self.query_attribute(class_i, attribute_name)
             
             MM.Identifier_Attribute.new(identifier_i.R22() & attribute_i.R22())
         
     def instantiate_types(self):
+        MM = self.MM
         all_types = self.types()
         for variant, type_list in all_types.items():
             for _type in type_list:
                 type_name = self.type_name(variant, _type)
                 type_attr = MM.Type.constraint(
                     {'Name' : type_name})
-                MM.Type.new(type_attr)
+                self.register(None, 'type', type_name, MM.Type.new(type_attr))
 
     def instantiate_rel(self, rel: dict, subsystem_i: MM.Subsystem.constraint, modeled_domain_i: MM.Modeled_Domain.constraint):
+        MM = self.MM
         rnum = rel['rnum']
         element_attr = MM.Element.constraint({'Number' : self.rnum_number(rnum)})
         element_i = MM.Element.new(element_attr & modeled_domain_i.R15())
 
         subsystem_element_i = MM.Subsystem_Element.new(subsystem_i.R13() & element_i.R16('Subsystem Element'))
         relationship_i = MM.Relationship.new(subsystem_element_i.R14('Relationship'))
+        self.register(modeled_domain_i['Name'], 'relationship', self.rnum_number(rnum), relationship_i)
         
         if rnum[0] == 'O':
             """ Ordinal Relationship """
@@ -208,9 +290,7 @@ class ModelInstantiator(ModelReader):
             
             identifier_i = exactly_one(MM.Identifier.query(identifier_attr & class_i.R27()))
             
-            attribute_attr = MM.Attribute.constraint(
-                {'Name' : ordinal_data['ranking_attribute']})
-            attribute_i = exactly_one(MM.Attribute.query(attribute_attr & class_i.R20()))
+            attribute_i = self.query_attribute(class_i, ordinal_data['ranking_attribute'])
             
             identifier_attribute_i = exactly_one(
                 MM.Identifier_Attribute.query(identifier_i.R22() & attribute_i.R22()))
@@ -318,6 +398,7 @@ class ModelInstantiator(ModelReader):
                     reference_i.R152('Generalization Reference') & superclass_i.R170() & subclass_i.R156())
             
     def instantiate_referential_attributes(self, modeled_domain_i, rnum, ref_letter : str, r155, side=None):
+        MM = self.MM
         reference_attr = MM.Reference.constraint({'Ref' : ref_letter})
         reference_i = MM.Reference.new(reference_attr & r155)
         
@@ -340,23 +421,20 @@ class ModelInstantiator(ModelReader):
         # From class {I, I2, /R21/Attribute.Class, R23}
         # To class {I, /R21c/Identifier Attribute.Class, R23}
         
-        def attribute_by_name(class_i: MM.Class.constraint, attribute_name: str) -> MM.Attribute.constraint:
-            attribute_attr = MM.Attribute.constraint({'Name' : attribute_name})
-            return exactly_one(MM.Attribute.query(attribute_attr & class_i.R20()))
-            
         number = {'I' : 1, 'I2' : 2, 'I3' :3}[ref_data['id']]
         identifier_attr = MM.Identifier_Attribute.constraint({'Identifier' : ('I', number)})
-        for to_attribute, from_attribute in ref_data['ref_map'].items():
-            attribute_i_to = attribute_by_name(class_i_to, to_attribute)
-            identifier_attribute_i = exactly_one(MM.Identifier_Attribute.query(identifier_attr & attribute_i_to.R22()))
-
-            attribute_i_from = attribute_by_name(class_i_from, from_attribute)
-
+        attribute_i_pairs = [(self.query_attribute(class_i_to, to_attribute), self.query_attribute(class_i_from, from_attribute))
+                             for to_attribute, from_attribute in ref_data['ref_map'].items()]
+        identifier_attribute_i_sets = MM.Identifier_Attribute.query_many(
+            [identifier_attr & attribute_i_to.R22() for attribute_i_to, _ in attribute_i_pairs])
+        for (attribute_i_to, attribute_i_from), identifier_attribute_i_set in zip(attribute_i_pairs, identifier_attribute_i_sets):
+            identifier_attribute_i = exactly_one(identifier_attribute_i_set)
             MM.Attribute_Reference.new(reference_i.R23() & identifier_attribute_i.R21() & attribute_i_from.R21())
 
         return reference_i
 
     def instantiate_state_model(self, state_model: StateModel, modeled_domain_i: MM.Modeled_Domain.constraint):
+        MM = self.MM
         
         lifecycle_i = None
         
@@ -385,12 +463,19 @@ class ModelInstantiator(ModelReader):
         for state in state_model.states:
             self.instantiate_state(state, modeled_domain_i, state_model_i, lifecycle_i)
             
+        implicit_transitions = dict()
+        if self.materialize_canthappen:
+            for transition in self.implicit_transitions(state_model):
+                implicit_transitions.setdefault(transition.event, []).append(transition)
+
         for event in state_model.events:
-            self.instantiate_events(event, state_model_i)
+            self.instantiate_events(event, state_model_i, implicit_transitions.get(event.name, []))
     
     def instantiate_events(self, 
                            event: EventSpec, 
-                           state_model_i: MM.State_Model.constraint):
+                           state_model_i: MM.State_Model.constraint,
+                           implicit_transitions: Optional[list[StateTransition]] = None):
+        MM = self.MM
         
         event_attr = MM.Event.constraint(
             {'Name': event.name,
@@ -400,7 +485,7 @@ class ModelInstantiator(ModelReader):
         event_i = MM.Event.new(event_attr)
         effective_event_i = MM.Effective_Event.new(event_i.R560('Effective Event'))
         
-        for transition in event.transitions:
+        for transition in event.transitions + (implicit_transitions or []):
             self.instantiate_event_response(transition, effective_event_i, state_model_i)
             
         event_specification_attr = MM.Event_Specification.constraint(
@@ -421,6 +506,7 @@ class ModelInstantiator(ModelReader):
     def instantiate_event_parameter(self, 
                                     parameter: Parameter, 
                                     event_specification_i: MM.Event_Specification.constraint):
+        MM = self.MM
         event_parameter_attr = MM.Event_Parameter.constraint(
             {'Name' : parameter.name,
              'Type' : parameter.type})
@@ -430,6 +516,7 @@ class ModelInstantiator(ModelReader):
                                    transition : StateTransition, 
                                    effective_event_i : MM.Effective_Event.constraint, 
                                    state_model_i: MM.State_Model.constraint):
+        MM = self.MM
 
         from_state_i = self.query_state(state_model_i, transition.origin)   
         event_response_i = MM.Event_Response.new(effective_event_i.R505() & from_state_i.R505())
@@ -451,6 +538,7 @@ class ModelInstantiator(ModelReader):
                           modeled_domain_i: MM.Modeled_Domain.constraint, 
                           state_model_i: MM.State_Model.constraint, 
                           lifecycle_i: Optional[MM.Lifecycle.constraint]):
+        MM = self.MM
  
         state_activity_i = self.instantiate_state_activity(state.activity, modeled_domain_i)
         
@@ -460,6 +548,7 @@ class ModelInstantiator(ModelReader):
                 'Domain': modeled_domain_i['Name']})
         
         state_i = MM.State.new(state_attr)
+        self.register(state_i['Domain'], 'state', (state_model_i['Name'], state.name), state_i)
         
         if state.type in ['creation']:
             if lifecycle_i is None:
@@ -482,6 +571,7 @@ class ModelInstantiator(ModelReader):
                 raise ManaException() # Error not valid state type
 
     def instantiate_state_activity(self, activity, modeled_domain_i: MM.Modeled_Domain.constraint):
+        MM = self.MM
         
         # Todo make better Activity code... (waiting on Flow Subsystem)
         # To be able to handle the moment 22 created by needing state models to receive events that are provided 
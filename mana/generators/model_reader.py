@@ -1,46 +1,89 @@
-import pprint
+from __future__ import annotations
 import sys
 from pathlib import Path
-from typing import Any, Iterator
+from typing import Any, Iterator, Optional, TYPE_CHECKING
 from collections import namedtuple
-from flatland.input.model_parser import ModelParser, Subsystem
-from flatland.input.statemodel_parser import StateModelParser, StateModel 
-from flatland.input.statemodel_visitor import StateBlock as FlatlandStateBlock, EventSpec as FlatlandEventSpec
-from flatland.flatland_exceptions import ModelParseError
+from mana.debug_artifacts import ArtifactWriter
+from mana.generators.parse_cache import ParseCache
+from mana.tracing import span
 from mana.warnings_and_exceptions import *
 
+if TYPE_CHECKING:
+    # flatland is only imported when parsing, see ModelReader.parse
+    from flatland.input.model_parser import Subsystem
+    from flatland.input.statemodel_parser import StateModel
+    from flatland.input.statemodel_visitor import StateBlock as FlatlandStateBlock, EventSpec as FlatlandEventSpec
+
 StateBlock = namedtuple('StateBlock', 'name type activity transitions')
 StateTransition = namedtuple('StateTransition', 'origin type to event')
 EventSpec = namedtuple('EventSpec', 'name type signature transitions')
 
+# Below this number of referentials a process pool costs more than it saves
+min_parallel_referentials = 200
+
+# Set per worker process by init_referential_worker
+referential_worker: Optional[ModelReader] = None
+
+def init_referential_worker(class_table: dict, relation_table: dict, class_to_subsys: dict):
+    global referential_worker
+    referential_worker = ModelReader.__new__(ModelReader)
+    referential_worker.class_table = class_table
+    referential_worker.relation_table = relation_table
+    referential_worker.class_to_subsys = class_to_subsys
+
+def solve_referential_task(task: tuple) -> tuple[list, str, str, bool]:
+    class_name, rnum, *tables = task
+    return referential_worker.solve_referential_attributes(
+        rnum, referential_worker.class_table[class_name], *tables)
+
 class ModelReader:
-    def __init__(self, jobs: dict):
+    def __init__(self, jobs: dict, artifacts: Optional[ArtifactWriter] = None, 
+                 parse_cache: Optional[ParseCache] = None):
         self.subsystems: list[Subsystem] = []
         self.input_statemodels: list[StateModel] = []
         self.jobs = jobs
+        self.artifacts = artifacts
+        self.parse_cache = parse_cache
 
-    def parse(self):
-        for parse_file in self.jobs['subsystems']:
-            parse_job = ModelParser(model_file_path=parse_file, debug=False)
+    def artifact_enabled(self, kind: str) -> bool:
+        return self.artifacts is not None and self.artifacts.enabled(kind)
+
+    def artifact_name(self, name: str) -> str:
+        return f'{type(self).__name__}-{name}'
+
+    def parse_file(self, parse_file: Path, parser_class, _type: str):
+        from flatland.flatland_exceptions import ModelParseError
+
+        def parse():
+            parse_job = parser_class(model_file_path=parse_file, debug=False)
             try:
-                self.subsystems.append(parse_job.parse())
+                return parse_job.parse()
             except ModelParseError as flatland_e:
                 raise ManaParserException(
-                    flatland_e.model_file, "class model", flatland_e.e)
+                    flatland_e.model_file, _type, flatland_e.e)
+
+        with span('parse', _type, parse_file):
+            if self.parse_cache is None:
+                return parse()
+            return self.parse_cache.get(parse_file, parse)
+
+    def parse(self):
+        from flatland.input.model_parser import ModelParser
+        from flatland.input.statemodel_parser import StateModelParser
+
+        for parse_file in self.jobs['subsystems']:
+            self.subsystems.append(
+                self.parse_file(parse_file, ModelParser, "class model"))
                 
         for parse_file in self.jobs['statemodels']:
-            parse_job = StateModelParser(model_file_path=parse_file, debug=False)
-            try:
-                self.input_statemodels.append(parse_job.parse())
-            except ModelParseError as flatland_e:
-                raise ManaParserException(
-                    flatland_e.model_file, "state model", flatland_e.e)
+            self.input_statemodels.append(
+                self.parse_file(parse_file, StateModelParser, "state model"))
 
-        # Print parsed data to file
-        with open("parse_data.txt", "w") as data_file:
-            pp = pprint.PrettyPrinter(indent=2, stream=data_file)
-            if len(self.input_statemodels) > 0:
-                pp.pprint(dict(self.input_statemodels[0]._asdict()))
+        if self.artifact_enabled('parse'):
+            parsed = zip(list(self.jobs['subsystems']) + list(self.jobs['statemodels']),
+                         self.subsystems + self.input_statemodels)
+            for parse_file, parse_data in parsed:
+                self.artifacts.dump('parse', self.artifact_name(Path(parse_file).stem), parse_data)
 
     def id(self, input: dict):
         """ pure function """
@@ -64,11 +107,25 @@ class ModelReader:
         """ function using self.referential_table """
         class_name = input['name']
         return self.referential_table[class_name]
+
+    def ordinal(self, input: dict):
+        """ function using self.ordinal_table, the ordinal relationships
+        ranking input by rnum """
+        return {rnum: data for rnum, data in sorted(self.ordinal_table.items())
+                if data['class'] == input['name']}
+
+    def generalization(self, input: dict):
+        """ function using self.generalization_table, the subclasses per
+        rnum where input is the superclass (subtypes) and the superclass per
+        rnum where it is a subclass (supertypes) """
+        return self.generalization_table.get(input['name'], {'subtypes': {}, 'supertypes': {}})
     
     def types(self):
         return self.type_table
 
-    def interpret(self):
+    def interpret(self, workers: int = 1):
+        """ workers > 1 solves the referential attributes in that many
+        processes, with results identical to the serial interpretation """
         # init values
         self.relation_table = dict()
         self.relation_to_subsys = dict()
@@ -76,16 +133,35 @@ class ModelReader:
         self.class_to_subsys = dict()
         self.referential_table = dict()
         self.ordinal_table = dict()
+        self.generalization_table = dict()
         self.class_attribute_table = dict()
         self.type_table = {'type' : [], 'union_type' : []}
         self.statemodels = []
         
         # run interpret functions
-        self.interpret_common()
-        self.interpret_relation_navigation()
-        self.interpret_referential()
-        self.interpret_types()
-        self.interpret_statemodels()
+        with span('interpret', 'common'):
+            self.interpret_common()
+        with span('interpret', 'relation navigation'):
+            self.interpret_relation_navigation()
+        with span('interpret', 'referential'):
+            self.interpret_referential(workers)
+        with span('interpret', 'generalizations'):
+            self.interpret_generalizations()
+        with span('interpret', 'types'):
+            self.interpret_types()
+        with span('interpret', 'statemodels'):
+            self.interpret_statemodels()
+
+        if self.artifact_enabled('interpret'):
+            self.artifacts.dump('interpret', self.artifact_name('tables'), {
+                'class_table' : self.class_table,
+                'relation_table' : self.relation_table,
+                'referential_table' : self.referential_table,
+                'ordinal_table' : self.ordinal_table,
+                'generalization_table' : self.generalization_table,
+                'statemodels' : self.statemodels})
+        if self.artifact_enabled('types'):
+            self.artifacts.dump('types', self.artifact_name('type_table'), self.type_table)
 
     def interpret_common(self):
         subsystem_table = dict()
@@ -116,42 +192,43 @@ class ModelReader:
 
             for a_class in subsys.classes:
                 class_name = a_class['name']
-                if 'import' in a_class:
-                    import_subsys_name = a_class['import']
-                    if class_name in self.class_to_subsys:
-                        if import_subsys_name.lower() == (self.class_to_subsys[class_name]).lower():
-                            continue  # all is ok!
-                        else:
-                            raise ManaClassImportedFromWrongSubsystemException(
-                                class_name,
-                                import_subsys_name,  # from
-                                subsys_name,  # into
-                                self.class_to_subsys[class_name])  # but declared in
-                    else:
-                        if import_subsys_name in subsystem_table:
-                            raise ManaClassMissingInSubsystemException(
-                                class_name, import_subsys_name)  # class is missing!
+                with span('interpret class', class_name):
+                    if 'import' in a_class:
+                        import_subsys_name = a_class['import']
+                        if class_name in self.class_to_subsys:
+                            if import_subsys_name.lower() == (self.class_to_subsys[class_name]).lower():
+                                continue  # all is ok!
+                            else:
+                                raise ManaClassImportedFromWrongSubsystemException(
+                                    class_name,
+                                    import_subsys_name,  # from
+                                    subsys_name,  # into
+                                    self.class_to_subsys[class_name])  # but declared in
                         else:
-                            print(ManaClassImportFromMissingSubsystemWarning(
-                                class_name, import_subsys_name))
-                if class_name in self.class_table:
-                    # this could only happen if more then one
-                    # ManaClassImportFromMissingSubsystemWarning is
-                    # issued (this is ok!)
-                    continue
-
-                if class_name not in self.class_to_subsys:
-                    # self.class_to_subsys is used for error messages...
-                    self.class_to_subsys[class_name] = subsys_name
+                            if import_subsys_name in subsystem_table:
+                                raise ManaClassMissingInSubsystemException(
+                                    class_name, import_subsys_name)  # class is missing!
+                            else:
+                                print(ManaClassImportFromMissingSubsystemWarning(
+                                    class_name, import_subsys_name))
+                    if class_name in self.class_table:
+                        # this could only happen if more then one
+                        # ManaClassImportFromMissingSubsystemWarning is
+                        # issued (this is ok!)
+                        continue
+
+                    if class_name not in self.class_to_subsys:
+                        # self.class_to_subsys is used for error messages...
+                        self.class_to_subsys[class_name] = subsys_name
 
-                a_class['cnum'] = len(self.class_table) + 1
-                self.class_table[class_name] = a_class
-                for attr in a_class['attributes']:
-                    self.class_attribute_table[(
-                        a_class['name'], attr['name'])] = attr
-                self.referential_table[class_name] = {
-                    'defined': [], 'inclusion': {}}
-                new_subsys_class_list.append(a_class)
+                    a_class['cnum'] = len(self.class_table) + 1
+                    self.class_table[class_name] = a_class
+                    for attr in a_class['attributes']:
+                        self.class_attribute_table[(
+                            a_class['name'], attr['name'])] = attr
+                    self.referential_table[class_name] = {
+                        'defined': [], 'inclusion': {}}
+                    new_subsys_class_list.append(a_class)
 
             new_subsystems.append(subsys._replace(
                 classes=new_subsys_class_list))
@@ -228,8 +305,10 @@ class ModelReader:
                     attr['nav_rnum'] = [relation_navigation_fix(class_name, nav_item)
                                         for nav_item in attr['nav_rnum']]
 
-    def interpret_referential(self):
-
+    def interpret_referential(self, workers: int = 1):
+        # (class name, rnum, inclusion, navigation and rename table of rnum)
+        # per referential to solve, in class order with sorted rnums
+        tasks = []
         for class_name, _class in self.class_table.items():
             if 'attributes' in _class:
                 ordinal_rnum_set = set()
@@ -286,11 +365,45 @@ class ModelReader:
                                 if attr['name'] in general_rename_table[rnum]:
                                     raise ManaException()  # Error redundent!
                                 general_rename_table[rnum][attr['name']] = ref_name
-                for rnum in ordinal_rnum_set:
-                    self.interpret_ordinal_relationship(rnum, _class)
+                for rnum in sorted(ordinal_rnum_set):
+                    with span('interpret ordinal', class_name, rnum):
+                        self.interpret_ordinal_relationship(rnum, _class)
                 
-                for rnum in defined_set:
-                    self.interpret_referential_attributes(rnum, _class, inclusion_table, nav_table, general_rename_table)
+                for rnum in sorted(defined_set):
+                    tasks.append((class_name, rnum, {rnum: inclusion_table[rnum]},
+                                  {rnum: nav_table[rnum]}, {rnum: general_rename_table[rnum]}))
+
+        # Solving only reads class_table and relation_table, hence it can be
+        # done in parallel, merging the solutions in task order keeps the
+        # referential_table the same as a serial run gives
+        if workers > 1 and len(tasks) >= min_parallel_referentials:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_referential_worker,
+                                     initargs=(self.class_table, self.relation_table, self.class_to_subsys)) as pool:
+                chunksize = max(1, len(tasks) // (4 * workers))
+                with span('interpret referential', len(tasks), 'referentials in', workers, 'processes'):
+                    solutions = list(pool.map(solve_referential_task, tasks, chunksize=chunksize))
+        else:
+            def solve(class_name, rnum, *tables):
+                with span('interpret referential', class_name, rnum):
+                    return self.solve_referential_attributes(rnum, self.class_table[class_name], *tables)
+            solutions = (solve(*task) for task in tasks)
+        for (class_name, rnum, *tables), solution in zip(tasks, solutions):
+            self.merge_referential_attributes(rnum, self.class_table[class_name], solution)
+
+    def interpret_generalizations(self):
+
+        def entry(class_name):
+            if class_name not in self.generalization_table:
+                self.generalization_table[class_name] = {'subtypes': dict(), 'supertypes': dict()}
+            return self.generalization_table[class_name]
+
+        for rnum, rel in sorted(self.relation_table.items()):
+            if 'superclass' in rel:
+                with span('interpret generalization', rel['superclass'], rnum):
+                    entry(rel['superclass'])['subtypes'][rnum] = list(rel['subclasses'])
+                    for subclass in rel['subclasses']:
+                        entry(subclass)['supertypes'][rnum] = rel['superclass']
 
     def interpret_ordinal_relationship(self, rnum: str, _class: dict):
         ''' Check Ordinal Relationship '''
@@ -328,7 +441,11 @@ class ModelReader:
             'ascending' : rel['t_side']['phrase'],
             'descending' : rel['p_side']['phrase']}
 
-    def interpret_referential_attributes(self, rnum: str, _class: dict, inclusion_table: dict, nav_table: dict, general_rename_table: dict):                           
+    def solve_referential_attributes(self, rnum: str, _class: dict, inclusion_table: dict, nav_table: dict, 
+                                     general_rename_table: dict) -> tuple[list, str, str, bool]:
+        """ function using self.class_table and self.relation_table, the
+        references of _class over rnum and their kind: (ref_list,
+        reference_type, relationship_type, has_variants) """
         
         def rel_other_end(rnum, my_end):
             if rnum not in self.relation_table:
@@ -580,7 +697,12 @@ class ModelReader:
         else:
             reference_type = 'to_one'
             relationship_type = 'binary'
+        return ref_list, reference_type, relationship_type, has_variants
 
+    def merge_referential_attributes(self, rnum: str, _class: dict, solution: tuple[list, str, str, bool]):
+        """ Add a solution of solve_referential_attributes to referential_table """
+        class_name = _class['name']
+        ref_list, reference_type, relationship_type, has_variants = solution
         for ref in ref_list:
             ref_table_entry = self.referential_table[ref['class_name']]
             if rnum not in ref_table_entry['defined']:
@@ -771,15 +893,13 @@ class ModelReader:
                 
                 
     def interpret_statemodel(self, input : StateModel) -> StateModel:
-        states=self.interpret_state(input.states, input.events.values())
-
-        return StateModel(
-            domain=input.domain, 
-            lifecycle=input.lifecycle, 
-            assigner=input.assigner,
-            events=self.interpret_events(input.events.values(), states),
-            states=states,
-            metadata=input.metadata)
+        with span('interpret state model', input.lifecycle['class'] if input.lifecycle
+                  else input.assigner['rel']):
+            states=self.interpret_state(input.states, input.events.values())
+
+            return input._replace(
+                events=self.interpret_events(input.events.values(), states),
+                states=states)
         
     def interpret_events(self, input: list[FlatlandEventSpec], states: list[StateBlock] ) -> list[EventSpec]:
         event2transitions: dict[str,list[StateTransition]] = dict()
@@ -791,7 +911,7 @@ class ModelReader:
         return [EventSpec(name=ei.name, 
                           type=ei.type, 
                           signature=ei.signature, 
-                          transitions=event2transitions[ei.name]
+                          transitions=event2transitions.get(ei.name, [])
                           ) for ei in input]
         
     def interpret_state(self, input: list[FlatlandStateBlock], events: list[FlatlandEventSpec]) -> list[StateBlock]:
@@ -833,11 +953,22 @@ class ModelReader:
         if explicit_event_set - all_event_set:
             raise ManaException() # Error, event not known!
         
-        for illegal_event in all_event_set - explicit_event_set:
-            output.append(StateTransition(event=illegal_event, origin=origin, to=None, type="canthappen"))
-            
+        # The state table is sparse, every (state, event) pair not listed
+        # here is implicitly a "can't happen", see response()
         return output
 
+    def state_table(self, statemodel: StateModel) -> dict[tuple[str, str], StateTransition]:
+        """ pure function, the explicit responses by (state, event) """
+        return {(t.origin, t.event): t for s in statemodel.states for t in s.transitions}
+
+    def implicit_transitions(self, statemodel: StateModel) -> Iterator[StateTransition]:
+        """ All implicit "can't happen" responses of a state model """
+        table = self.state_table(statemodel)
+        for state in statemodel.states:
+            for event in statemodel.events:
+                if (state.name, event.name) not in table:
+                    yield StateTransition(event=event.name, origin=state.name, to=None, type="canthappen")
+
 
 
         
@@ -0,0 +1,42 @@
+import copy
+import os
+import threading
+from pathlib import Path
+from typing import Any, Callable
+
+
+class ParseCache:
+    """ Parsed model files kept warm between runs in one process.
+
+    An entry is valid as long as the modification time and size of its
+    file are unchanged. Readers get a deep copy since interpreting mutates
+    the parsed data.
+    """
+    def __init__(self):
+        self._entries: dict[Path, tuple[tuple[int, int], Any]] = dict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def stamp(path: Path) -> tuple[int, int]:
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def get(self, path: Path, parse: Callable[[], Any]) -> Any:
+        path = Path(path).resolve()
+        stamp = self.stamp(path)
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry is not None and entry[0] == stamp:
+            self.hits += 1
+            return copy.deepcopy(entry[1])
+        self.misses += 1
+        data = parse()
+        with self._lock:
+            self._entries[path] = (stamp, data)
+        return copy.deepcopy(data)
+
+    def invalidate(self, path: Path):
+        with self._lock:
+            self._entries.pop(Path(path).resolve(), None)
@@ -0,0 +1,208 @@
+""" The class-relationship graph of an interpreted model (see
+ModelReader.interpret) as sparse adjacency matrices.
+
+Classes are numbered in class_table order. Per relationship kind there is
+one matrix in CSR form, edges go from the formalizing class to the class it
+refers to:
+
+association:    to-one references of binary associations
+associative:    associative classes to their participants
+generalization: subclasses to their superclass
+ordinal:        a class ranked by an ordinal relationship to itself
+
+The algorithms only use flat int arrays and iterative loops, no recursion.
+"""
+from array import array
+from collections import Counter, deque
+from itertools import accumulate
+from typing import Iterable, Optional
+from mana.generators.model_reader import ModelReader
+from mana.warnings_and_exceptions import *
+
+kinds = ('association', 'associative', 'generalization', 'ordinal')
+
+
+class Adjacency:
+    """ Compressed sparse rows, the edges of node n are
+    indices[indptr[n]:indptr[n + 1]] labeled rnums[indptr[n]:indptr[n + 1]],
+    sources holds the node of every edge """
+    def __init__(self, size: int, sources: array, targets: array, rnums: list[str]):
+        order = sorted(range(len(sources)), key=sources.__getitem__)
+        self.size = size
+        self.sources = array('i', [sources[edge] for edge in order])
+        self.indices = array('i', [targets[edge] for edge in order])
+        self.rnums = [rnums[edge] for edge in order]
+        counts = array('i', [0]) * (size + 1)
+        for node, count in Counter(self.sources).items():
+            counts[node + 1] = count
+        self.indptr = array('i', accumulate(counts))
+
+    def edges(self) -> Iterable[tuple[int, int, str]]:
+        return zip(self.sources, self.indices, self.rnums)
+
+    def neighbors(self, node: int) -> array:
+        return self.indices[self.indptr[node]:self.indptr[node + 1]]
+
+    def transpose(self) -> 'Adjacency':
+        return Adjacency(self.size, self.indices, self.sources, self.rnums)
+
+    def __len__(self):
+        return len(self.indices)
+
+
+class ClassGraph:
+    def __init__(self, names: list[str], edges: dict[str, list[tuple[int, int, str]]]):
+        self.names = names
+        self.ids = {name: number for number, name in enumerate(names)}
+        self.matrices = dict()
+        for kind in kinds:
+            edge_list = edges.get(kind, [])
+            self.matrices[kind] = Adjacency(len(names), array('i', [edge[0] for edge in edge_list]),
+                                            array('i', [edge[1] for edge in edge_list]),
+                                            [edge[2] for edge in edge_list])
+        self.unions: dict[tuple, Adjacency] = dict()
+
+    @classmethod
+    def from_reader(cls, reader: ModelReader) -> 'ClassGraph':
+        """ The graph of reader's class_table, referential_table and
+        ordinal_table, interpret must have been run """
+        names = list(reader.class_table)
+        ids = {name: number for number, name in enumerate(names)}
+        edges = {kind: [] for kind in kinds}
+        for class_name, entry in reader.referential_table.items():
+            for rnum in entry['defined']:
+                inclusion = entry['inclusion'][rnum]
+                if inclusion['relationship_type'] == 'generalization':
+                    kind = 'generalization'
+                elif inclusion['reference_type'] == 'associative':
+                    kind = 'associative'
+                else:
+                    kind = 'association'
+                data_list = inclusion['variant'].values() if inclusion['has_variants'] else [inclusion['data']]
+                for data in data_list:
+                    edges[kind].append((ids[data['formalizing_class']['name']], ids[class_name], rnum))
+        for rnum, data in reader.ordinal_table.items():
+            edges['ordinal'].append((ids[data['class']], ids[data['class']], rnum))
+        return cls(names, edges)
+
+    def combined(self, selected: Optional[Iterable[str]] = None, undirected: bool = False) -> Adjacency:
+        """ The union of the matrices of the selected kinds (default all),
+        with undirected every edge in both directions """
+        selected = tuple(kinds if selected is None else selected)
+        union = self.unions.get((selected, undirected))
+        if union is None:
+            sources, targets, rnums = array('i'), array('i'), []
+            for kind in selected:
+                matrix = self.matrices[kind]
+                sources += matrix.sources
+                targets += matrix.indices
+                rnums += matrix.rnums
+            if undirected:
+                sources, targets, rnums = sources + targets, targets + sources, rnums + rnums
+            union = self.unions[(selected, undirected)] = Adjacency(len(self.names), sources, targets, rnums)
+        return union
+
+    def components(self) -> list[list[str]]:
+        """ Connected components, ignoring edge direction """
+        matrix = self.combined(undirected=True)
+        indptr, indices = matrix.indptr, matrix.indices
+        label = array('i', [-1]) * len(self.names)
+        out = []
+        for start in range(len(self.names)):
+            if label[start] >= 0:
+                continue
+            label[start] = start
+            members = [start]
+            for node in members:
+                for neighbor in indices[indptr[node]:indptr[node + 1]]:
+                    if label[neighbor] < 0:
+                        label[neighbor] = start
+                        members.append(neighbor)
+            out.append([self.names[member] for member in members])
+        return out
+
+    def strongly_connected_components(self) -> list[list[str]]:
+        """ Tarjan's algorithm, a component comes after every component it
+        has an edge to """
+        matrix = self.combined()
+        indptr, indices = matrix.indptr, matrix.indices
+        size = len(self.names)
+        index = array('i', [-1]) * size
+        lowlink = array('i', [0]) * size
+        on_stack = bytearray(size)
+        stack: list[int] = []
+        out = []
+        counter = 0
+        for start in range(size):
+            if index[start] >= 0:
+                continue
+            work = [(start, indptr[start])]
+            index[start] = lowlink[start] = counter
+            counter += 1
+            stack.append(start)
+            on_stack[start] = 1
+            while work:
+                node, position = work[-1]
+                if position < indptr[node + 1]:
+                    work[-1] = (node, position + 1)
+                    target = indices[position]
+                    if index[target] < 0:
+                        index[target] = lowlink[target] = counter
+                        counter += 1
+                        stack.append(target)
+                        on_stack[target] = 1
+                        work.append((target, indptr[target]))
+                    elif on_stack[target]:
+                        lowlink[node] = min(lowlink[node], index[target])
+                    continue
+                work.pop()
+                if work:
+                    parent_node = work[-1][0]
+                    lowlink[parent_node] = min(lowlink[parent_node], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = 0
+                        component.append(self.names[member])
+                        if member == node:
+                            break
+                    out.append(component)
+        return out
+
+    def dependency_order(self) -> list[list[str]]:
+        """ Groups of classes such that every class only refers to classes
+        of its own or earlier groups, a group of more than one class is a
+        referential cycle """
+        return self.strongly_connected_components()
+
+    def shortest_path(self, source: str, target: str,
+                      selected: Optional[Iterable[str]] = None) -> Optional[list[tuple[str, str]]]:
+        """ The fewest relationships to navigate from source to target, as
+        (rnum, class reached) steps, None if target can not be reached """
+        if source not in self.ids or target not in self.ids:
+            raise ManaException()
+        matrix = self.combined(selected, undirected=True)
+        indptr, indices, rnums = matrix.indptr, matrix.indices, matrix.rnums
+        start, goal = self.ids[source], self.ids[target]
+        via = array('i', [-1]) * len(self.names)  # edge position the node was reached by
+        came_from = array('i', [-1]) * len(self.names)
+        seen = bytearray(len(self.names))
+        seen[start] = 1
+        queue = deque([start])
+        while queue:
+            node = queue.popleft()
+            if node == goal:
+                steps = []
+                while node != start:
+                    steps.append((rnums[via[node]], self.names[node]))
+                    node = came_from[node]
+                return steps[::-1]
+            for position in range(indptr[node], indptr[node + 1]):
+                neighbor = indices[position]
+                if not seen[neighbor]:
+                    seen[neighbor] = 1
+                    via[neighbor] = position
+                    came_from[neighbor] = node
+                    queue.append(neighbor)
+        return None
@@ -0,0 +1,24 @@
+import json
+from pathlib import Path
+from mana.warnings_and_exceptions import *
+
+
+def json_job(job_path: Path):
+    with open(job_path) as job_file:
+        data_in_file = json.load(job_file)
+    
+    path_at_file = job_path.resolve().parent
+    if 'subsystems' not in data_in_file:
+        raise ManaException()
+    
+    out = {
+        'subsystems': [path_at_file / subsystem for subsystem in data_in_file['subsystems']],
+        'statemodels': [path_at_file / subsystem for subsystem in data_in_file.get('statemodels', [])]}
+       
+    return out
+
+
+def job_files(job_path: Path) -> list[Path]:
+    """ The job file and all model files it refers to """
+    job = json_job(job_path)
+    return [Path(job_path)] + job['subsystems'] + job['statemodels']
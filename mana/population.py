@@ -0,0 +1,43 @@
+from types import ModuleType
+from typing import Any
+from mana.runtime import loaded_classes, package_class
+from mana.warnings_and_exceptions import *
+
+
+def instance_count(meta_model: ModuleType) -> int:
+    # classes of subsystems that are not loaded yet have no instances
+    return sum(len(_class.store) for _class in loaded_classes(meta_model).values())
+
+
+def rows(_class: type, instances: list) -> list[list[Any]]:
+    return [[instance.data[attr] for attr in _class.attr_list] for instance in instances]
+
+
+def facts(meta_model: ModuleType) -> dict[str, dict]:
+    """ The population as facts, one relation per class of the loaded
+    subsystems (the classes of the others have no instances, exporting
+    does not load them) """
+    return {name: {'attributes': list(_class.attr_list),
+                   'rows': rows(_class, _class.all())}
+            for name, _class in loaded_classes(meta_model).items()}
+
+
+def from_json_value(value: Any) -> Any:
+    """ pure function, json arrays back to the tuples used in the population """
+    if isinstance(value, list):
+        return tuple(from_json_value(item) for item in value)
+    return value
+
+
+def query(meta_model: ModuleType, class_name: str, where: dict) -> dict:
+    """ Instances of class_name (code or model name) matching the attribute
+    values in where, in the same format as facts """
+    code_name = '_'.join(class_name.split())
+    if not any(code_name in class_names for class_names in meta_model.subsystem_class_names.values()):
+        raise ManaException()  # unknown class
+    # loads only the subsystem of the class
+    _class = package_class(vars(meta_model), code_name)
+    constraint = _class.constraint(
+        {attr: from_json_value(value) for attr, value in where.items()})
+    return {'attributes': list(_class.attr_list),
+            'rows': rows(_class, _class.query(constraint))}
@@ -0,0 +1,790 @@
+""" Runtime shared by all generated meta model classes.
+
+A generated class only holds metadata, e.g.:
+
+    class Order(MetaClass):
+        attr_list = ['ID', 'Customer']
+        id1_list = ['ID']
+        references = {'R5': ('Order_Line', (('ID', 'Order'),))}
+
+attr_list:  all attributes
+idN_list:   the attributes of identifier N (I, I2, I3)
+references: per relationship where the class is referred to, the
+            formalizing class and the (own attribute, referential attribute)
+            pairs, for generalizations a dict of these per subclass name
+ordinals:   per ordinal relationship ranking the class, the ranking
+            attribute and the attributes of the identifier it is part of
+subtypes:   per generalization of the class as superclass, the subclasses
+supertypes: per generalization of the class as subclass, the superclass
+
+MetaClass.__init_subclass__ gives every class its own store and its constraint
+class. The store holds the population, a DictStore (a dict per identifier)
+unless the root module has a store_factory (see use_store). The formalizing class names are resolved on first
+navigation, through the meta model package the class was loaded into.
+
+Navigation: constraint.R<n>() is the partial constraint of the formalizing
+class, for to-one references constraint.R<n>_instance() is the instance
+itself, resolved once and then cached on the constraint.
+
+Class.ordinal(rnum) is an OrdinalIndex, the instances ordered by the ranking
+attribute, built on first use and kept up to date by new().
+
+Generalizations: Class.subtype(rnum, instance) and Class.supertype(rnum,
+instance) are the instance one level down or up the hierarchy, by a
+SubtypeIndex per generalization that is built on first use.
+Class.concrete(instance) are the most specific instances below an instance,
+Class.query_subtree(constraint) these for all matching instances.
+
+A forked population (see mana.generators.meta_model_loader.fork_population)
+is a fresh load of the meta model with an OverlayStore per class, reading
+through to the parent's store and keeping only its own changes. The parent
+then raises ManaException on new and delete.
+
+Queries that are no identifier lookup scan the population, their results are
+kept per class in a LRU cache that new() clears (see query_statistics).
+
+The generated root module of a meta model only names its subsystems and
+classes, its module __getattr__ (see subsystem_loader) executes a subsystem
+module the first time one of its classes is used.
+"""
+from __future__ import annotations
+import gc
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from operator import itemgetter
+from types import MappingProxyType, ModuleType
+from typing import Any, Callable, Iterator, Optional, Union
+from mana.warnings_and_exceptions import *
+
+max_identifiers = 3
+
+
+class Constraint:
+    """ A (partial) set of attribute values of meta_class, an instance if
+    all attributes are given """
+    __slots__ = ('data', 'resolved')
+    meta_class: type[MetaClass]
+
+    def __init__(self, input: dict):
+        if not self.meta_class.attr_set.issuperset(input):
+            raise ManaException()
+        self.data = input
+        # R<n>_instance results: navigation -> (target class version, instance)
+        self.resolved: Optional[dict] = None
+
+    def try_key(self, id_list: list) -> tuple | None:
+        data = self.data
+        for attr in id_list:
+            if attr not in data:
+                return None
+        return tuple([data[attr] for attr in id_list])
+
+    def to_key(self, id_list: list) -> tuple:
+        return_value = self.try_key(id_list)
+        if return_value is None:
+            raise ManaException()
+        return return_value
+
+    def is_value_subset(self, other_c: Constraint) -> bool:
+        other_data = other_c.data
+        for key, value in self.data.items():
+            if value != other_data[key]:
+                return False
+        return True
+
+    def __and__(self, other_c: Constraint) -> Constraint:
+        if type(other_c) is not type(self):
+            raise ManaException()  # bad otherwise!
+        small, big = sorted([self.data, other_c.data], key=len)
+        for key, value in small.items():
+            if key in big and big[key] != value:
+                raise ManaException()  # only ok if values is the same!
+        return type(self)(self.data | other_c.data)
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __repr__(self):
+        return f'{self.meta_class.__name__}.constraint({self.data!r})'
+
+
+def navigation(rnum: str, variants: bool) -> Callable:
+    """ The R<n> method of a constraint, projects the constraint onto the
+    referential attributes of the formalizing class """
+    if variants:
+        def navigate(self, key: str):
+            meta_class = self.meta_class
+            links = meta_class.links[rnum] if rnum in meta_class.links else meta_class.link(rnum)
+            ref_class, ref_table = links[key]
+            data = self.data
+            return ref_class.constraint({attr_ref: data[attr_source] for attr_source, attr_ref in ref_table})
+    else:
+        def navigate(self):
+            meta_class = self.meta_class
+            ref_class, ref_table = meta_class.links[rnum] if rnum in meta_class.links else meta_class.link(rnum)
+            data = self.data
+            return ref_class.constraint({attr_ref: data[attr_source] for attr_source, attr_ref in ref_table})
+    navigate.__name__ = navigate.__qualname__ = rnum
+    return navigate
+
+
+def instance_navigation(rnum: str) -> Callable:
+    """ The R<n>_instance method of a constraint, for to-one references:
+    the instance R<n>() identifies, or None. The result is cached on the
+    constraint until an identifier table of the target class changes. """
+    def navigate_instance(self, key: Optional[str] = None):
+        resolved = self.resolved
+        if resolved is None:
+            resolved = self.resolved = dict()
+        cache_key = rnum if key is None else (rnum, key)
+        entry = resolved.get(cache_key)
+        if entry is not None:
+            ref_class, version, instance = entry
+            if ref_class.version == version:
+                return instance
+
+        target = getattr(self, rnum)() if key is None else getattr(self, rnum)(key)
+        ref_class = target.meta_class
+        for number, id_list in enumerate(ref_class.id_lists):
+            target_key = target.try_key(id_list)
+            if target_key is not None:
+                instance = ref_class.store.get(number, target_key)
+                resolved[cache_key] = (ref_class, ref_class.version, instance)
+                return instance
+        raise ManaException()  # not a to-one reference, R<n>() identifies no single instance
+    navigate_instance.__name__ = navigate_instance.__qualname__ = f'{rnum}_instance'
+    return navigate_instance
+
+
+class DictStore:
+    """ The population of a class, per identifier (number as in id_lists) a
+    dict from the identifier values to the instance """
+    def __init__(self, meta_class: type[MetaClass]):
+        self.tables = tuple(dict() for _ in meta_class.id_lists)
+
+    def get(self, number: int, key: tuple) -> Optional[Constraint]:
+        return self.tables[number].get(key)
+
+    def get_many(self, number: int, keys: list[tuple]) -> list[Optional[Constraint]]:
+        get = self.tables[number].get
+        return [get(key) for key in keys]
+
+    def contains(self, number: int, key: tuple) -> bool:
+        return key in self.tables[number]
+
+    def add(self, keys: list[tuple], constraint: Constraint):
+        for key, table in zip(keys, self.tables):
+            table[key] = constraint
+
+    def remove(self, keys: list[tuple]):
+        for key, table in zip(keys, self.tables):
+            del table[key]
+
+    def scan(self, items) -> list[Constraint]:
+        """ The instances with all (attribute, value) items """
+        return [candidate for candidate in self.tables[0].values()
+                if all(candidate.data[attr] == value for attr, value in items)]
+
+    def items(self) -> Iterator[tuple[tuple, Constraint]]:
+        """ (first identifier, instance) per instance """
+        return iter(self.tables[0].items())
+
+    def all(self) -> list[Constraint]:
+        return list(self.tables[0].values())
+
+    def __len__(self):
+        return len(self.tables[0])
+
+
+class OverlayStore:
+    """ Copy-on-write view of the store of a parent population, same methods
+    as DictStore. The parent's tables are shared, only the instances added
+    (a DictStore) and the identifiers removed here are kept. Instances of the
+    parent are read through as instances of this class, sharing their data.
+    The parent must not change any more. """
+    def __init__(self, meta_class: type[MetaClass], parent: Any):
+        self.meta_class = meta_class
+        self.parent = parent
+        self.added = DictStore(meta_class)
+        # identifiers of removed parent instances, per identifier number
+        self.removed: tuple[set, ...] = tuple(set() for _ in meta_class.id_lists)
+
+    def rebind(self, constraint: Constraint) -> Constraint:
+        return self.meta_class.constraint(constraint.data)
+
+    def get(self, number: int, key: tuple) -> Optional[Constraint]:
+        constraint = self.added.get(number, key)
+        if constraint is None and key not in self.removed[number]:
+            constraint = self.parent.get(number, key)
+            if constraint is not None:
+                constraint = self.rebind(constraint)
+        return constraint
+
+    def get_many(self, number: int, keys: list[tuple]) -> list[Optional[Constraint]]:
+        return [self.get(number, key) for key in keys]
+
+    def contains(self, number: int, key: tuple) -> bool:
+        return self.added.contains(number, key) or (
+            key not in self.removed[number] and self.parent.contains(number, key))
+
+    def add(self, keys: list[tuple], constraint: Constraint):
+        self.added.add(keys, constraint)
+
+    def remove(self, keys: list[tuple]):
+        if self.added.contains(0, keys[0]):
+            self.added.remove(keys)
+        else:
+            for key, removed in zip(keys, self.removed):
+                removed.add(key)
+
+    def visible(self, constraints: list[Constraint]) -> list[Constraint]:
+        """ The parent's constraints that are not removed, rebound """
+        removed = self.removed[0]
+        if not removed:
+            return [self.rebind(constraint) for constraint in constraints]
+        id_list = self.meta_class.id_lists[0]
+        return [self.rebind(constraint) for constraint in constraints
+                if constraint.to_key(id_list) not in removed]
+
+    def scan(self, items) -> list[Constraint]:
+        return self.visible(self.parent.scan(items)) + self.added.scan(items)
+
+    def items(self) -> Iterator[tuple[tuple, Constraint]]:
+        removed = self.removed[0]
+        for key, constraint in self.parent.items():
+            if key not in removed:
+                yield key, self.rebind(constraint)
+        yield from self.added.items()
+
+    def all(self) -> list[Constraint]:
+        return self.visible(self.parent.all()) + self.added.all()
+
+    def __len__(self):
+        return len(self.parent) - len(self.removed[0]) + len(self.added)
+
+
+class FrozenStore:
+    """ Read-only copy of the store of a class (see freeze), same methods as
+    DictStore. Adding or removing instances raises ManaException, the
+    identifier tables are read-only views. """
+    def __init__(self, meta_class: type[MetaClass], store: Any):
+        self.instances = tuple(store.all())
+        self.tables = tuple(MappingProxyType({constraint.to_key(id_list): constraint
+                                              for constraint in self.instances})
+                            for id_list in meta_class.id_lists)
+
+    def get(self, number: int, key: tuple) -> Optional[Constraint]:
+        return self.tables[number].get(key)
+
+    def get_many(self, number: int, keys: list[tuple]) -> list[Optional[Constraint]]:
+        get = self.tables[number].get
+        return [get(key) for key in keys]
+
+    def contains(self, number: int, key: tuple) -> bool:
+        return key in self.tables[number]
+
+    def add(self, keys: list[tuple], constraint: Constraint):
+        raise ManaException()  # frozen
+
+    def remove(self, keys: list[tuple]):
+        raise ManaException()  # frozen
+
+    def scan(self, items) -> list[Constraint]:
+        return [candidate for candidate in self.instances
+                if all(candidate.data[attr] == value for attr, value in items)]
+
+    def items(self) -> Iterator[tuple[tuple, Constraint]]:
+        return iter(self.tables[0].items())
+
+    def all(self) -> list[Constraint]:
+        return list(self.instances)
+
+    def __len__(self):
+        return len(self.instances)
+
+
+class OrdinalIndex:
+    """ The instances of a class ranked by an ordinal relationship. The
+    instances with the same values for the other attributes of the ordinal
+    identifier form a group, ranked by the ranking attribute. A group is
+    given by any constraint holding these values, e.g. an instance. """
+    def __init__(self, ranking: str, id_list: list[str]):
+        self.ranking = ranking
+        self.group_list = [attr for attr in id_list if attr != ranking]
+        # group -> (sorted ranks, instances in the same order)
+        self.groups: dict[tuple, tuple[list, list[Constraint]]] = dict()
+
+    def add(self, constraint: Constraint):
+        ranks, instances = self.groups.setdefault(constraint.to_key(self.group_list), ([], []))
+        rank = constraint[self.ranking]
+        position = bisect_right(ranks, rank)
+        ranks.insert(position, rank)
+        instances.insert(position, constraint)
+
+    def remove(self, constraint: Constraint):
+        ranks, instances = self.groups[constraint.to_key(self.group_list)]
+        position = bisect_left(ranks, constraint[self.ranking])
+        del ranks[position]
+        del instances[position]
+
+    def group(self, constraint: Constraint) -> tuple[list, list[Constraint]]:
+        return self.groups.get(constraint.to_key(self.group_list), ([], []))
+
+    def next(self, constraint: Constraint) -> Optional[Constraint]:
+        """ The instance ranked right after constraint, or None """
+        ranks, instances = self.group(constraint)
+        position = bisect_right(ranks, constraint[self.ranking])
+        return instances[position] if position < len(instances) else None
+
+    def previous(self, constraint: Constraint) -> Optional[Constraint]:
+        """ The instance ranked right before constraint, or None """
+        ranks, instances = self.group(constraint)
+        position = bisect_left(ranks, constraint[self.ranking])
+        return instances[position - 1] if position > 0 else None
+
+    def range(self, constraint: Constraint, low: Any = None, high: Any = None) -> list[Constraint]:
+        """ The instances of the group ranked from low up to high (both
+        included, None for no bound), in rank order """
+        ranks, instances = self.group(constraint)
+        start = 0 if low is None else bisect_left(ranks, low)
+        end = len(ranks) if high is None else bisect_right(ranks, high)
+        return instances[start:end]
+
+    def first(self, constraint: Constraint, count: int = 1) -> list[Constraint]:
+        """ The count lowest ranked instances of the group """
+        return self.group(constraint)[1][:count]
+
+    def last(self, constraint: Constraint, count: int = 1) -> list[Constraint]:
+        """ The count highest ranked instances of the group, highest first """
+        instances = self.group(constraint)[1]
+        return instances[:-count - 1:-1] if count > 0 else []
+
+
+class SubtypeIndex:
+    """ The subclass instance per superclass instance for one generalization,
+    by the superclass identifier the subclasses refer to. The subclasses add
+    their new instances (see MetaClass.supertype_indexes). """
+    def __init__(self, superclass: type[MetaClass], links: dict[str, tuple]):
+        self.instances: dict[tuple, Constraint] = dict()
+        # subclass -> its referential attributes of the superclass identifier
+        self.key_refs: dict[type[MetaClass], list[str]] = dict()
+        self.number = None
+        for subclass, ref_table in links.values():
+            ref_of = dict(ref_table)
+            for number, id_list in enumerate(superclass.id_lists):
+                if all(attr in ref_of for attr in id_list):
+                    break
+            else:
+                raise ManaException()  # the subclass refers to no identifier
+            if self.number is None:
+                self.number = number
+            elif number != self.number:
+                raise ManaException()  # the subclasses refer to other identifiers
+            self.key_refs[subclass] = [ref_of[attr] for attr in superclass.id_lists[number]]
+
+        if self.number is None:
+            # no subclass links, an empty index by the first identifier, if any
+            self.number = 0
+            self.id_list = superclass.id_lists[0] if superclass.id_lists else []
+            return
+        self.id_list = superclass.id_lists[self.number]
+        for subclass, key_refs in self.key_refs.items():
+            for constraint in subclass.store.all():
+                self.add(key_refs, constraint)
+            subclass.supertype_indexes.append((self, key_refs))
+
+    def add(self, key_refs: list[str], constraint: Constraint):
+        data = constraint.data
+        self.instances[tuple([data[attr] for attr in key_refs])] = constraint
+
+
+def class_navigation(rnum: str) -> classmethod:
+    """ The R<n> class method, e.g. Customer.R1(customer_i) """
+    def navigate(cls, constraint: Constraint, *key: str):
+        return getattr(constraint, rnum)(*key)
+    navigate.__name__ = navigate.__qualname__ = rnum
+    return classmethod(navigate)
+
+
+class MetaClass:
+    attr_list: list[str] = []
+    references: dict[str, Union[tuple, dict[str, tuple]]] = dict()
+    ordinals: dict[str, tuple[str, list[str]]] = dict()
+    subtypes: dict[str, list[str]] = dict()
+    supertypes: dict[str, str] = dict()
+
+    # Namespace of the meta model root module, set when the class is loaded
+    package: Optional[dict] = None
+
+    # Set per class by __init_subclass__, version changes with every change
+    # of the population (see R<n>_instance)
+    version: int
+    attr_set: frozenset
+    id_lists: tuple
+    id_sets: tuple
+    store: DictStore
+    ordinal_indexes: dict[str, OrdinalIndex]
+    subtype_indexes: dict[str, SubtypeIndex]
+    # the indexes of superclasses this class adds its instances to
+    supertype_indexes: list[tuple[SubtypeIndex, list[str]]]
+
+    # Set by freeze, the population does not change any more
+    frozen: bool = False
+    # Set by fork_population, forks read through to the population, hence
+    # new and delete raise
+    forked: bool = False
+
+    # Scan results of query by constraint contents, at most query_cache_size
+    query_cache_size: int = 256
+    query_cache: OrderedDict
+    query_hits: int
+    query_misses: int
+
+    links: dict
+    constraint: type[Constraint]
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.attr_set = frozenset(cls.attr_list)
+        cls.id_lists = tuple(cls.__dict__[f'id{number}_list'] for number in range(1, max_identifiers + 1)
+                             if f'id{number}_list' in cls.__dict__)
+        cls.id_sets = tuple(frozenset(id_list) for id_list in cls.id_lists)
+        cls.store = DictStore(cls)
+        cls.ordinal_indexes = dict()
+        cls.subtype_indexes = dict()
+        cls.supertype_indexes = []
+        cls.links = dict()
+        cls.version = 0
+        cls.query_cache = OrderedDict()
+        cls.query_hits = 0
+        cls.query_misses = 0
+
+        namespace = {'__slots__': (), 'meta_class': cls, '__qualname__': f'{cls.__qualname__}.constraint'}
+        for rnum, reference in cls.references.items():
+            namespace[rnum] = navigation(rnum, isinstance(reference, dict))
+            namespace[f'{rnum}_instance'] = instance_navigation(rnum)
+            setattr(cls, rnum, class_navigation(rnum))
+        cls.constraint = type('constraint', (Constraint,), namespace)
+
+    @classmethod
+    def link(cls, rnum: str) -> Union[tuple, dict[str, tuple]]:
+        """ Resolve the formalizing class name(s) of reference rnum, this
+        loads the subsystem of a formalizing class if needed """
+        reference = cls.references[rnum]
+        if isinstance(reference, dict):
+            links = {key: (package_class(cls.package, ref_class), ref_table)
+                     for key, (ref_class, ref_table) in reference.items()}
+        else:
+            ref_class, ref_table = reference
+            links = (package_class(cls.package, ref_class), ref_table)
+        cls.links[rnum] = links
+        return links
+
+    @classmethod
+    def freeze(cls):
+        """ Make the population read-only and build the indexes that are
+        otherwise built on first use, readers then never change the class """
+        if cls.frozen:
+            return
+        cls.store = FrozenStore(cls, cls.store)
+        cls.frozen = True
+        for rnum in cls.references:
+            if rnum not in cls.links:
+                cls.link(rnum)
+        for rnum in cls.ordinals:
+            cls.ordinal(rnum)
+        for rnum in cls.subtypes:
+            cls.subtype_index(rnum)
+
+    @classmethod
+    def ordinal(cls, rnum: str) -> OrdinalIndex:
+        """ The index of ordinal relationship rnum, built from the population
+        the first time """
+        ordinal_index = cls.ordinal_indexes.get(rnum)
+        if ordinal_index is None:
+            ranking, id_list = cls.ordinals[rnum]
+            ordinal_index = OrdinalIndex(ranking, id_list)
+            for constraint in sorted(cls.store.all(), key=lambda constraint: constraint[ranking]):
+                ordinal_index.add(constraint)
+            cls.ordinal_indexes[rnum] = ordinal_index
+        return ordinal_index
+
+    @classmethod
+    def subtype_index(cls, rnum: str) -> SubtypeIndex:
+        subtype_index = cls.subtype_indexes.get(rnum)
+        if subtype_index is None:
+            links = cls.links[rnum] if rnum in cls.links else cls.link(rnum)
+            subtype_index = cls.subtype_indexes[rnum] = SubtypeIndex(cls, links)
+        return subtype_index
+
+    @classmethod
+    def subtype(cls, rnum: str, constraint: Constraint) -> Optional[Constraint]:
+        """ The subclass instance of superclass instance constraint in
+        generalization rnum """
+        subtype_index = cls.subtype_index(rnum)
+        return subtype_index.instances.get(constraint.try_key(subtype_index.id_list))
+
+    @classmethod
+    def supertype(cls, rnum: str, constraint: Constraint) -> Optional[Constraint]:
+        """ The superclass instance of subclass instance constraint in
+        generalization rnum """
+        superclass = package_class(cls.package, cls.supertypes[rnum])
+        subtype_index = superclass.subtype_index(rnum)
+        data = constraint.data
+        return superclass.store.get(subtype_index.number,
+                                    tuple([data[attr] for attr in subtype_index.key_refs[cls]]))
+
+    @classmethod
+    def concrete(cls, constraint: Constraint) -> list[Constraint]:
+        """ The most specific instances below instance constraint, following
+        every generalization of its class, or the instance itself """
+        out = []
+        for rnum in cls.subtypes:
+            subtype_i = cls.subtype(rnum, constraint)
+            if subtype_i is not None:
+                out += subtype_i.meta_class.concrete(subtype_i)
+        return out if out else [constraint]
+
+    @classmethod
+    def query_subtree(cls, constraint: Constraint) -> list[Constraint]:
+        """ Polymorphic query, the most specific instances of the instances
+        query gives """
+        return [concrete_i for instance in cls.query(constraint) for concrete_i in cls.concrete(instance)]
+
+    @classmethod
+    def new(cls, constraint: Constraint) -> Constraint:
+        if cls.forked:
+            raise ManaException()  # a fork reads through to this population
+        # Check that constraint is containg all attributes for the class
+        if constraint.data.keys() != cls.attr_set:
+            raise ManaException()
+
+        # Check that no duplicate exists for any id (I, I2, I3)
+        store = cls.store
+        keys = [constraint.to_key(id_list) for id_list in cls.id_lists]
+        for number, key in enumerate(keys):
+            if store.contains(number, key):
+                raise ManaException()
+
+        # Add instance
+        store.add(keys, constraint)
+        for ordinal_index in cls.ordinal_indexes.values():
+            ordinal_index.add(constraint)
+        for subtype_index, key_refs in cls.supertype_indexes:
+            subtype_index.add(key_refs, constraint)
+        cls.version += 1
+        cls.query_cache.clear()
+        return constraint
+
+    @classmethod
+    def delete(cls, constraint: Constraint):
+        """ Remove instance constraint (found by its identifiers) """
+        if cls.forked:
+            raise ManaException()  # a fork reads through to this population
+        store = cls.store
+        keys = [constraint.to_key(id_list) for id_list in cls.id_lists]
+        instance = store.get(0, keys[0])
+        if instance is None:
+            raise ManaException()  # no such instance
+
+        store.remove(keys)
+        for ordinal_index in cls.ordinal_indexes.values():
+            ordinal_index.remove(instance)
+        for subtype_index, key_refs in cls.supertype_indexes:
+            subtype_index.instances.pop(tuple([instance.data[attr] for attr in key_refs]), None)
+        cls.version += 1
+        cls.query_cache.clear()
+
+    @classmethod
+    def value(cls, constraint: Constraint, attribute: str) -> Any:
+        return constraint[attribute]
+
+    @classmethod
+    def query(cls, constraint: Constraint) -> list[Constraint]:
+        for number, id_list in enumerate(cls.id_lists):
+            key = constraint.try_key(id_list)
+            if key is not None:
+                # if there is an valid key => either the item exists or not
+                instance = cls.store.get(number, key)
+                return [] if instance is None else [instance]
+
+        items = constraint.data.items()
+        try:
+            cache_key = frozenset(items)
+        except TypeError:
+            cache_key = None  # unhashable values are not cached
+        cache = cls.query_cache
+        result = cache.get(cache_key)
+        if result is not None:
+            cls.query_hits += 1
+            if not cls.frozen:
+                cache.move_to_end(cache_key)
+            return list(result)
+
+        cls.query_misses += 1
+        result = cls.store.scan(items)
+        if cache_key is not None and cls.query_cache_size > 0:
+            if not cls.frozen:
+                cache[cache_key] = result
+                if len(cache) > cls.query_cache_size:
+                    cache.popitem(last=False)
+            elif len(cache) < cls.query_cache_size:
+                # no reordering or eviction, readers need no lock
+                cache[cache_key] = result
+        return list(result)
+
+    @classmethod
+    def query_many(cls, constraints: list[Constraint]) -> list[list[Constraint]]:
+        """ query for each constraint, aligned with constraints. The
+        constraints giving an identifier are grouped by it and every group
+        is looked up at once, the others are queried one by one. """
+        results: list = [None] * len(constraints)
+        groups: dict[int, list[int]] = dict()
+        for position, constraint in enumerate(constraints):
+            keys = constraint.data.keys()
+            for number, id_set in enumerate(cls.id_sets):
+                if keys >= id_set:
+                    groups.setdefault(number, []).append(position)
+                    break
+            else:
+                results[position] = cls.query(constraint)
+
+        for number, positions in groups.items():
+            id_list = cls.id_lists[number]
+            key_of = itemgetter(*id_list)
+            if len(id_list) == 1:
+                keys = [(key_of(constraints[position].data),) for position in positions]
+            else:
+                keys = [key_of(constraints[position].data) for position in positions]
+            for position, instance in zip(positions, cls.store.get_many(number, keys)):
+                results[position] = [] if instance is None else [instance]
+        return results
+
+    @classmethod
+    def all(cls) -> list[Constraint]:
+        return cls.store.all()
+
+    @classmethod
+    def op_id(cls, op: Callable[[list[bool]], bool], constraint: Constraint) -> bool:
+        return op([cls.store.contains(number, constraint.to_key(id_list))
+                   for number, id_list in enumerate(cls.id_lists)])
+
+    @classmethod
+    def all_id(cls, constraint: Constraint) -> bool:
+        return cls.op_id(all, constraint)
+
+    @classmethod
+    def any_id(cls, constraint: Constraint) -> bool:
+        return cls.op_id(any, constraint)
+
+
+def subsystem_loader(namespace: dict) -> Callable[[str], Any]:
+    """ The module __getattr__ (PEP 562) of a meta model root module.
+
+    namespace is the root module's, it holds subsystem_modules (module per
+    subsystem), subsystem_class_names (class names per subsystem) and
+    subsystem_code (code per module, set by load_meta_model), frozen (set
+    by freeze, the classes are then frozen once loaded) and forked (set by
+    fork_population, the classes are then marked forked once loaded). Loaded
+    subsystem modules are kept in loaded_subsystems and their classes are
+    added to the namespace, hence __getattr__ is only called once per class.
+    subsystem_classes loads all subsystems.
+    """
+    class_subsystem = {class_name: subsystem
+                       for subsystem, class_names in namespace['subsystem_class_names'].items()
+                       for class_name in class_names}
+    loaded_subsystems: dict[str, ModuleType] = dict()
+    namespace['loaded_subsystems'] = loaded_subsystems
+    lock = threading.RLock()
+
+    def load(subsystem: str) -> ModuleType:
+        with lock:
+            if subsystem not in loaded_subsystems:
+                module_name = namespace['subsystem_modules'][subsystem]
+                module = ModuleType(f"{namespace['__name__']}.{module_name}")
+                exec(namespace['subsystem_code'][module_name], module.__dict__)
+                for class_name in namespace['subsystem_class_names'][subsystem]:
+                    _class = module.__dict__[class_name]
+                    _class.package = namespace
+                    if namespace.get('store_factory') is not None:
+                        _class.store = namespace['store_factory'](_class)
+                    if namespace.get('forked'):
+                        _class.forked = True
+                    namespace[class_name] = _class
+                loaded_subsystems[subsystem] = module
+                if namespace.get('frozen'):
+                    # loaded after freeze, readers expect no class to change
+                    for class_name in namespace['subsystem_class_names'][subsystem]:
+                        module.__dict__[class_name].freeze()
+            return loaded_subsystems[subsystem]
+
+    def __getattr__(name: str) -> Any:
+        if name in class_subsystem:
+            load(class_subsystem[name])
+            return namespace[name]
+        if name == 'subsystem_classes':
+            subsystem_classes = {subsystem: [package_class(namespace, class_name) for class_name in class_names]
+                                 for subsystem, class_names in namespace['subsystem_class_names'].items()}
+            namespace['subsystem_classes'] = subsystem_classes
+            return subsystem_classes
+        raise AttributeError(f"module {namespace['__name__']!r} has no attribute {name!r}")
+
+    return __getattr__
+
+
+def package_class(namespace: dict, class_name: str) -> type[MetaClass]:
+    """ A class from a meta model root module namespace, loaded if needed """
+    return namespace[class_name] if class_name in namespace else namespace['__getattr__'](class_name)
+
+
+def freeze(meta_model: ModuleType, gc_freeze: bool = False):
+    """ Make the population of meta_model read-only (see MetaClass.freeze),
+    it can then be read by any number of threads without locks. Classes of
+    subsystems loaded later are frozen empty when they are loaded.
+
+    gc_freeze moves all objects to the permanent generation (gc.freeze), so
+    worker processes forked afterwards share the population pages instead of
+    copying them when the garbage collector runs. """
+    meta_model.frozen = True
+    # freezing resolves links, which may load further subsystems
+    pending = list(loaded_classes(meta_model).values())
+    while pending:
+        for _class in pending:
+            _class.freeze()
+        pending = [_class for _class in loaded_classes(meta_model).values() if not _class.frozen]
+    if gc_freeze:
+        gc.collect()
+        gc.freeze()
+
+
+def use_store(meta_model: ModuleType, store_factory: Callable[[type[MetaClass]], Any]):
+    """ Keep the population of meta_model in the stores store_factory makes
+    per class (same methods as DictStore), before any instance is added """
+    for _class in loaded_classes(meta_model).values():
+        if len(_class.store):
+            raise ManaException()  # the population would be lost
+        _class.store = store_factory(_class)
+    meta_model.store_factory = store_factory
+
+
+def loaded_classes(meta_model: ModuleType) -> dict[str, type[MetaClass]]:
+    """ The classes of the already loaded subsystems by code name """
+    return {class_name: getattr(meta_model, class_name)
+            for subsystem in meta_model.loaded_subsystems
+            for class_name in meta_model.subsystem_class_names[subsystem]}
+
+
+def query_statistics(meta_model: ModuleType) -> dict:
+    """ Query cache hits and misses of the loaded classes, per class (only
+    classes that were queried) and in total """
+    classes = dict()
+    for class_name, _class in loaded_classes(meta_model).items():
+        if _class.query_hits or _class.query_misses:
+            classes[class_name] = {'hits': _class.query_hits, 'misses': _class.query_misses}
+    hits = sum(stats['hits'] for stats in classes.values())
+    misses = sum(stats['misses'] for stats in classes.values())
+    return {'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+            'classes': classes}
@@ -0,0 +1,179 @@
+""" Populations in a SQLite database instead of dicts, for populations that
+do not fit in memory and as a reusable artifact.
+
+Each generated class gets a table with a column per attribute and a unique
+index per identifier. Instances are read back as new constraints, so only
+the instances in use are in memory.
+
+Values: str, int, float and None are stored as such, other values (tuples,
+bool) as the bytes of their repr, so an equality on the encoded values is an
+equality on the values and can use the indexes.
+
+new() is batched: added rows are kept until batch_size rows are pending or
+the database is read, then inserted in one transaction.
+"""
+import ast
+import sqlite3
+from pathlib import Path
+from typing import Any, Iterator, Optional, Union
+from types import ModuleType
+from mana.runtime import Constraint, MetaClass, use_store
+from mana.warnings_and_exceptions import *
+
+native_types = (str, int, float, type(None))
+
+
+def encode(value: Any) -> Any:
+    """ pure function, the column value of an attribute value """
+    return value if type(value) in native_types else repr(value).encode('utf-8')
+
+
+def decode(value: Any) -> Any:
+    """ pure function, inverse of encode """
+    return ast.literal_eval(value.decode('utf-8')) if type(value) is bytes else value
+
+
+def quote(name: str) -> str:
+    """ pure function, a SQL identifier """
+    return '"' + name.replace('"', '""') + '"'
+
+
+class SqliteDatabase:
+    """ One database file for all classes of a population, use attach to
+    make a meta model use it """
+    def __init__(self, path: Union[Path, str], batch_size: int = 10000):
+        self.path = path
+        self.batch_size = batch_size
+        self.connection = sqlite3.connect(str(path), check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.stores: list[SqliteStore] = []
+        self.pending = 0
+
+    def store(self, meta_class: type[MetaClass]) -> 'SqliteStore':
+        store = SqliteStore(self, meta_class)
+        self.stores.append(store)
+        return store
+
+    def attach(self, meta_model: ModuleType):
+        use_store(meta_model, self.store)
+
+    def flush(self):
+        """ Insert all pending rows in one transaction """
+        if not self.pending:
+            return
+        try:
+            with self.connection:
+                for store in self.stores:
+                    if store.pending_rows:
+                        self.connection.executemany(store.insert_sql, store.pending_rows)
+        except sqlite3.IntegrityError as e:
+            raise ManaException() from e  # a duplicate identifier slipped through
+        for store in self.stores:
+            store.pending_rows.clear()
+            for keys in store.pending_keys:
+                keys.clear()
+        self.pending = 0
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.connection.close()
+
+
+class SqliteStore:
+    """ The population of one class in a table, same methods as DictStore """
+    def __init__(self, database: SqliteDatabase, meta_class: type[MetaClass]):
+        self.database = database
+        self.meta_class = meta_class
+        self.attr_list = list(meta_class.attr_list)
+        self.id_lists = meta_class.id_lists
+        table = quote(meta_class.__name__)
+        columns = ', '.join(quote(attr) for attr in self.attr_list)
+
+        connection = database.connection
+        with connection:
+            connection.execute(f'CREATE TABLE IF NOT EXISTS {table} ({columns})')
+            for number, id_list in enumerate(self.id_lists):
+                connection.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS {quote(f"{meta_class.__name__}_I{number + 1}")} '
+                                   f'ON {table} ({", ".join(quote(attr) for attr in id_list)})')
+        self.table = table
+        self.select_sql = f'SELECT {columns} FROM {table}'
+        self.insert_sql = f'INSERT INTO {table} ({columns}) VALUES ({", ".join("?" * len(self.attr_list))})'
+        self.key_sql = [f'{self.select_sql} WHERE {self.where(id_list)}' for id_list in self.id_lists]
+        self.delete_sql = f'DELETE FROM {table} WHERE {self.where(self.id_lists[0])}'
+        # Attribute groups with an index, the identifiers and the ones queried
+        self.indexed = {frozenset(id_list) for id_list in self.id_lists}
+
+        # Rows not inserted yet, their identifiers per identifier number
+        self.pending_rows: list[tuple] = []
+        self.pending_keys: tuple[dict, ...] = tuple(dict() for _ in self.id_lists)
+
+    @staticmethod
+    def where(attributes) -> str:
+        return ' AND '.join(f'{quote(attr)} IS ?' for attr in attributes)
+
+    def instance(self, row: tuple) -> Constraint:
+        return self.meta_class.constraint({attr: decode(value) for attr, value in zip(self.attr_list, row)})
+
+    def get(self, number: int, key: tuple) -> Optional[Constraint]:
+        pending = self.pending_keys[number].get(key)
+        if pending is not None:
+            return pending
+        row = self.database.connection.execute(self.key_sql[number], [encode(value) for value in key]).fetchone()
+        return None if row is None else self.instance(row)
+
+    def get_many(self, number: int, keys: list[tuple]) -> list[Optional[Constraint]]:
+        return [self.get(number, key) for key in keys]
+
+    def contains(self, number: int, key: tuple) -> bool:
+        return key in self.pending_keys[number] or self.database.connection.execute(
+            self.key_sql[number], [encode(value) for value in key]).fetchone() is not None
+
+    def add(self, keys: list[tuple], constraint: Constraint):
+        data = constraint.data
+        self.pending_rows.append(tuple([encode(data[attr]) for attr in self.attr_list]))
+        for key, pending in zip(keys, self.pending_keys):
+            pending[key] = constraint
+        self.database.pending += 1
+        if self.database.pending >= self.database.batch_size:
+            self.database.flush()
+
+    def remove(self, keys: list[tuple]):
+        """ Delete the instance with the identifiers keys, after inserting
+        the pending rows (flush also drops their keys) """
+        self.database.flush()
+        with self.database.connection as connection:
+            connection.execute(self.delete_sql, [encode(value) for value in keys[0]])
+
+    def scan(self, items) -> list[Constraint]:
+        """ The instances with all (attribute, value) items, an attribute
+        group is indexed the first time it is queried (e.g. the referential
+        attributes of a navigation) """
+        self.database.flush()
+        attributes = [attr for attr, _ in items]
+        connection = self.database.connection
+        group = frozenset(attributes)
+        if group and group not in self.indexed:
+            name = quote(f'{self.meta_class.__name__}_{"_".join(sorted(attributes))}')
+            with connection:
+                connection.execute(f'CREATE INDEX IF NOT EXISTS {name} '
+                                   f'ON {self.table} ({", ".join(quote(attr) for attr in sorted(attributes))})')
+            self.indexed.add(group)
+        sql = f'{self.select_sql} WHERE {self.where(attributes)}' if attributes else self.select_sql
+        return [self.instance(row) for row in connection.execute(sql, [encode(value) for _, value in items])]
+
+    def items(self) -> Iterator[tuple[tuple, Constraint]]:
+        """ (first identifier, instance) per instance """
+        id_list = self.id_lists[0]
+        for instance in self.all():
+            yield instance.to_key(id_list), instance
+
+    def all(self) -> list[Constraint]:
+        self.database.flush()
+        return [self.instance(row) for row in self.database.connection.execute(self.select_sql)]
+
+    def __len__(self):
+        self.database.flush()
+        return self.database.connection.execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()[0]
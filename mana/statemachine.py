@@ -0,0 +1,282 @@
+import random
+from array import array
+from collections import deque
+from types import ModuleType
+from typing import Any, Hashable, Iterable, Optional
+from mana.warnings_and_exceptions import *
+
+# Dispatch table cells, a cell >= 0 is the target state index
+IGNORE = -1
+CANTHAPPEN = -2
+# Instance state after entering a deletion state
+DELETED = -1
+
+behavior_cells = {'IGN': IGNORE, 'CH': CANTHAPPEN}
+
+
+class StateMachine:
+    """ One state model compiled to a dense dispatch table, the response of
+    state s on event e is table[s * len(events) + e] """
+    def __init__(self, name: Hashable, domain: str, states: list, events: list,
+                 table: array, initial: list[int], deletion: set[int]):
+        self.name = name
+        self.domain = domain
+        self.states = states
+        self.events = events
+        self.table = table
+        self.initial = initial
+        self.deletion = deletion
+        self.state_index = {state: index for index, state in enumerate(states)}
+        self.event_index = {event: index for index, event in enumerate(events)}
+
+    def response(self, state: str, event: str) -> Any:
+        """ The target state name, or 'IGN' / 'CH' """
+        cell = self.table[self.state_index[state] * len(self.events) + self.event_index[event]]
+        return self.states[cell] if cell >= 0 else {IGNORE: 'IGN', CANTHAPPEN: 'CH'}[cell]
+
+    def unreachable_states(self) -> list:
+        """ States that no transition path leads to from an initial pseudo
+        state. Without initial pseudo states instances are created directly
+        in any state, then no state is unreachable. """
+        if not self.initial:
+            return []
+        width = len(self.events)
+        reached = set(self.initial)
+        pending = list(self.initial)
+        while pending:
+            state = pending.pop()
+            for cell in self.table[state * width:(state + 1) * width]:
+                if cell >= 0 and cell not in reached:
+                    reached.add(cell)
+                    pending.append(cell)
+        return [name for index, name in enumerate(self.states) if index not in reached]
+
+
+def compile_state_machines(meta_model: ModuleType) -> dict[Hashable, StateMachine]:
+    """ Compile every State Model of an instantiated population, by (name,
+    domain) since state model names are only unique per domain. Responses
+    missing in the population are the implicit "can't happen". """
+    MM = meta_model
+    states_by_model = dict()
+    for state_i in MM.State.all():
+        states_by_model.setdefault((state_i['State model'], state_i['Domain']), []).append(state_i)
+    events_by_model = dict()
+    for event_i in MM.Effective_Event.all():
+        events_by_model.setdefault((event_i['Subsystem element'], event_i['Domain']), []).append(event_i)
+
+    # An Event Response is found by projecting a state and an event on R505,
+    # its (state, event) cell by projecting it on the attributes of both
+    state_attrs = tuple(next(iter(states_by_model.values()))[0].R505().data) if states_by_model else ()
+    event_attrs = tuple(next(iter(events_by_model.values()))[0].R505().data) if events_by_model else ()
+    state_at = {tuple(state_i.R505()[attr] for attr in state_attrs): index
+                for state_list in states_by_model.values() for index, state_i in enumerate(state_list)}
+    event_at = {tuple(event_i.R505()[attr] for attr in event_attrs): index
+                for event_list in events_by_model.values() for index, event_i in enumerate(event_list)}
+    responses_by_model = dict()
+    for event_response_i in MM.Event_Response.all():
+        s = state_at.get(tuple(event_response_i[attr] for attr in state_attrs))
+        e = event_at.get(tuple(event_response_i[attr] for attr in event_attrs))
+        if s is not None and e is not None:
+            model_key = (event_response_i['State model'], event_response_i['Domain'])
+            responses_by_model.setdefault(model_key, []).append((s, e, event_response_i))
+
+    machines = dict()
+    for state_model_i in MM.State_Model.all():
+        model_key = (state_model_i['Name'], state_model_i['Domain'])
+        state_list = states_by_model.get(model_key, [])
+        event_list = events_by_model.get(model_key, [])
+
+        # The To state of a transition is found by projecting the states on R507
+        to_state_attrs = list(state_list[0].R507().data.keys()) if state_list else []
+        state_by_projection = {tuple(state_i.R507()[attr] for attr in to_state_attrs): index
+                               for index, state_i in enumerate(state_list)}
+
+        # responses missing in the population stay the implicit can't happen
+        table = array('i', [CANTHAPPEN]) * (len(state_list) * len(event_list))
+        for s, e, event_response_i in responses_by_model.get(model_key, []):
+            transition_i = MM.Transition.query(event_response_i.R506('Transition'))
+            if transition_i:
+                projection = tuple(transition_i[0][attr] for attr in to_state_attrs)
+                table[s * len(event_list) + e] = state_by_projection[projection]
+            else:
+                non_transition_i = MM.Non_Transition.query(event_response_i.R506('Non Transition'))
+                table[s * len(event_list) + e] = behavior_cells[non_transition_i[0]['Behavior']]
+
+        initial = [index for index, state_i in enumerate(state_list)
+                   if MM.Initial_Pseudo_State.query(state_i.R510('Initial Pseudo State'))]
+        deletion = set()
+        for index, state_i in enumerate(state_list):
+            for real_state_i in MM.Real_State.query(state_i.R510('Real State')):
+                if MM.Deletion_State.query(real_state_i.R511('Deletion State')):
+                    deletion.add(index)
+
+        machines[model_key] = StateMachine(
+            state_model_i['Name'], state_model_i['Domain'],
+            [state_i['Name'] for state_i in state_list],
+            [event_i['Name'] for event_i in event_list],
+            table, initial, deletion)
+    return machines
+
+
+class Simulator:
+    """ Executes events on any number of lifecycle instances. All state
+    machines share one flat dispatch table, an instance is an int and its
+    state is a global state index, so dispatching an event is two array
+    lookups.
+
+    canthappen: events hitting a "can't happen" are counted and the first
+    max_recorded hits are kept as (machine, instance, state, event), with
+    strict=True the first hit raises ManaCantHappenException instead.
+    lost: events for deleted instances. """
+    def __init__(self, machines: dict[Hashable, StateMachine], strict: bool = False,
+                 max_recorded: int = 1000):
+        self.machines = machines
+        self.strict = strict
+        self.max_recorded = max_recorded
+
+        self.table = array('i')
+        self.row = array('i')         # global state -> offset of its row in table
+        self.state_base = dict()      # machine key -> global index of its first state
+        self.machine_of_state = []    # global state -> machine key
+        self.deletion = bytearray()   # global state -> 1 if a deletion state
+        for name, machine in machines.items():
+            base = len(self.row)
+            self.state_base[name] = base
+            width = len(machine.events)
+            for s in range(len(machine.states)):
+                self.row.append(len(self.table))
+                for cell in machine.table[s * width:(s + 1) * width]:
+                    self.table.append(base + cell if cell >= 0 else cell)
+                self.machine_of_state.append(name)
+                self.deletion.append(1 if s in machine.deletion else 0)
+
+        self.instance_state = array('i')
+        self.instance_machine: list[Hashable] = []
+        self.queue: deque[tuple[int, int]] = deque()
+        self.visits = array('q', [0]) * len(self.row)
+        self.dispatched = 0
+        self.ignored = 0
+        self.canthappen = 0
+        self.lost = 0
+        self.canthappen_hits: list[tuple] = []
+
+    @classmethod
+    def from_population(cls, meta_model: ModuleType, **kwargs) -> 'Simulator':
+        return cls(compile_state_machines(meta_model), **kwargs)
+
+    def create(self, machine_name: Hashable, state: Optional[str] = None) -> int:
+        """ A new instance, in the initial pseudo state or else in state """
+        machine = self.machines[machine_name]
+        if state is None:
+            if not machine.initial:
+                raise ManaException()  # no initial pseudo state, the state must be given
+            local = machine.initial[0]
+        else:
+            local = machine.state_index[state]
+        global_state = self.state_base[machine_name] + local
+        self.instance_state.append(global_state)
+        self.instance_machine.append(machine_name)
+        self.visits[global_state] += 1
+        return len(self.instance_state) - 1
+
+    def signal(self, instance: int, event: str):
+        """ Queue event (by name) for instance """
+        machine = self.machines[self.instance_machine[instance]]
+        self.queue.append((instance, machine.event_index[event]))
+
+    def signal_index(self, instance: int, event: int):
+        """ Queue event by its index in the instance's state machine """
+        self.queue.append((instance, event))
+
+    def state(self, instance: int) -> Optional[str]:
+        """ Current state name, None once the instance is deleted """
+        global_state = self.instance_state[instance]
+        if global_state == DELETED:
+            return None
+        machine_name = self.instance_machine[instance]
+        return self.machines[machine_name].states[global_state - self.state_base[machine_name]]
+
+    def canthappen_hit(self, instance: int, state: int, event: int):
+        self.canthappen += 1
+        machine_name = self.machine_of_state[state]
+        machine = self.machines[machine_name]
+        hit = (machine_name, instance, machine.states[state - self.state_base[machine_name]], machine.events[event])
+        if self.strict:
+            raise ManaCantHappenException(f'{machine.name} ({machine.domain})', *hit[1:])
+        if len(self.canthappen_hits) < self.max_recorded:
+            self.canthappen_hits.append(hit)
+
+    def run(self, max_events: Optional[int] = None) -> int:
+        """ Dispatch queued events (also the ones queued meanwhile) until
+        the queue is empty or max_events are dispatched """
+        queue, table, row = self.queue, self.table, self.row
+        instance_state, visits, deletion = self.instance_state, self.visits, self.deletion
+        popleft = queue.popleft
+        limit = float('inf') if max_events is None else max_events
+        count = 0
+        try:
+            while queue and count < limit:
+                instance, event = popleft()
+                count += 1
+                state = instance_state[instance]
+                if state < 0:
+                    self.lost += 1
+                    continue
+                cell = table[row[state] + event]
+                if cell >= 0:
+                    visits[cell] += 1
+                    instance_state[instance] = DELETED if deletion[cell] else cell
+                elif cell == IGNORE:
+                    self.ignored += 1
+                else:
+                    self.canthappen_hit(instance, state, event)
+        finally:
+            self.dispatched += count
+        return count
+
+    def replay(self, trace: Iterable[tuple[Hashable, Hashable, str]]) -> int:
+        """ Run a recorded trace of (machine, instance key, event) entries,
+        an instance is created in its initial pseudo state the first time
+        its key appears """
+        instances: dict[tuple, int] = dict()
+        for machine_name, key, event in trace:
+            instance = instances.get((machine_name, key))
+            if instance is None:
+                instance = instances[(machine_name, key)] = self.create(machine_name)
+            self.signal(instance, event)
+        return self.run()
+
+    def fuzz(self, machine_name: Hashable, instances: int, events: int, seed: Optional[int] = None) -> int:
+        """ Create instances and send them events random events, the same
+        seed gives the same run """
+        machine = self.machines.get(machine_name)
+        if machine is None:
+            raise ManaFuzzException(machine_name, 'there is no such state machine')
+        if instances < 1:
+            raise ManaFuzzException(machine_name, f'{instances} instances requested, at least one is needed')
+        if events > 0 and not machine.events:
+            raise ManaFuzzException(machine_name, 'it has no events')
+        if not machine.states:
+            raise ManaFuzzException(machine_name, 'it has no states')
+        created = [self.create(machine_name) if machine.initial else
+                   self.create(machine_name, machine.states[0]) for _ in range(instances)]
+        choose = random.Random(seed).choices
+        self.queue.extend(zip(choose(created, k=events), choose(range(len(machine.events)), k=events)))
+        return self.run()
+
+    def unvisited_states(self) -> dict[Hashable, list]:
+        """ States per machine that no instance has entered so far """
+        out = dict()
+        for name, machine in self.machines.items():
+            base = self.state_base[name]
+            out[name] = [state for index, state in enumerate(machine.states)
+                         if not self.visits[base + index]]
+        return out
+
+    def statistics(self) -> dict:
+        return {'instances': len(self.instance_state),
+                'dispatched': self.dispatched,
+                'ignored': self.ignored,
+                'canthappen': self.canthappen,
+                'lost': self.lost,
+                'queued': len(self.queue)}
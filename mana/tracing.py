@@ -0,0 +1,92 @@
+""" Opt-in span tracing in the Chrome trace event format, for viewing where
+the time of a run went in chrome://tracing or ui.perfetto.dev.
+
+Spans are only recorded between enable() and disable(), otherwise span()
+returns a shared no-op context manager. A span is one tuple in a ring
+buffer, when it is full the oldest spans are dropped (and counted).
+
+    with span('instantiate class', class_name):
+        ...
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Any, ContextManager, Optional
+
+null_span = nullcontext()
+
+
+class Tracer:
+    def __init__(self, capacity: int = 1_000_000):
+        # (name, category, start ns, duration ns, thread id)
+        self.spans: deque[tuple[str, str, int, int, int]] = deque(maxlen=capacity)
+        self.recorded = 0
+        self.origin = time.perf_counter_ns()
+
+    def dropped(self) -> int:
+        return self.recorded - len(self.spans)
+
+    def events(self) -> list[dict]:
+        pid = os.getpid()
+        origin = self.origin
+        return [{'name': name, 'cat': category, 'ph': 'X', 'pid': pid, 'tid': tid,
+                 'ts': (start - origin) / 1000, 'dur': duration / 1000}
+                for name, category, start, duration, tid in self.spans]
+
+    def write(self, path: Path):
+        """ Write the recorded spans as a trace event JSON file """
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w') as trace_file:
+            json.dump({'traceEvents': self.events(),
+                       'displayTimeUnit': 'ms',
+                       'otherData': {'dropped_spans': self.dropped()}},
+                      trace_file, separators=(',', ':'))
+
+
+class Span:
+    __slots__ = ('tracer', 'name', 'category', 'start')
+
+    def __init__(self, tracer: Tracer, name: str, category: str):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = time.perf_counter_ns()
+        tracer = self.tracer
+        tracer.spans.append((self.name, self.category, self.start, end - self.start, threading.get_ident()))
+        tracer.recorded += 1
+        return False
+
+
+tracer: Optional[Tracer] = None
+
+
+def enable(capacity: int = 1_000_000) -> Tracer:
+    """ Start recording spans, into a new tracer """
+    global tracer
+    tracer = Tracer(capacity)
+    return tracer
+
+
+def disable() -> Optional[Tracer]:
+    """ Stop recording spans, the tracer that recorded them """
+    global tracer
+    stopped, tracer = tracer, None
+    return stopped
+
+
+def span(category: str, *name: Any) -> ContextManager:
+    """ A span named by the name parts, they are only formatted when
+    tracing is enabled """
+    if tracer is None:
+        return null_span
+    return Span(tracer, ' '.join(map(str, name)), category)
@@ -9,6 +9,10 @@ def output_str(input : str):
     return 'Model-Analysis: [' \
        + '\n                 '.join(rows) + ']'
 
+def diagnostic(e : Exception) -> dict:
+    """ pure function, an exception as reportable data """
+    return {'exception': type(e).__name__, 'message': str(e)}
+
 
 class ManaClassImportFromMissingSubsystemWarning():
     def __init__(self, _class : str, subsys : str):
@@ -21,6 +25,17 @@ class ManaClassImportFromMissingSubsystemWarning():
         text = part1 + part2
         return output_str(text)
 
+class ManaArtifactWriteWarning():
+    def __init__(self, file_path, e : Exception):
+        self.file_path = file_path
+        self.e = e
+    
+    def __str__(self):
+        part1 = f'Warning, could not write debug artifact: "{self.file_path}"'
+        part2 = f'\n{self.e}'
+        text = part1 + part2
+        return output_str(text)
+
 class ManaException(Exception):
     def __init__(self, exit = False):
         self._exit = exit
@@ -146,3 +161,44 @@ class ManaInvalidReferentialAttributeException(ManaException):
         part3 = f' in Subsystem: "{self.subsys}"'
         text = part1 + part2 + part3
         return output_str(text)
+
+class ManaUnknownArtifactKindException(ManaException):
+    def __init__(self, kind : str, known_kinds : list):
+        self.kind = kind
+        self.known_kinds = known_kinds
+        
+    def __str__(self):
+        part1 = f'Unknown debug artifact: "{self.kind}"'
+        part2 = ', valid artifacts are: "' + '", "'.join(self.known_kinds) + '"'
+        text = part1 + part2
+        return output_str(text)
+
+class ManaMetaModelUnavailableException(ManaException):
+    def __init__(self, job_path):
+        self.job_path = job_path
+        
+    def __str__(self):
+        text = f'No meta model available from job: "{self.job_path}"'
+        return output_str(text)
+
+class ManaCantHappenException(ManaException):
+    def __init__(self, state_model, instance : int, state : str, event : str):
+        self.state_model = state_model
+        self.instance = instance
+        self.state = state
+        self.event = event
+        
+    def __str__(self):
+        part1 = f'Event: "{self.event}" can not happen in State: "{self.state}"'
+        part2 = f'\nof State Model: "{self.state_model}", instance: {self.instance}'
+        text = part1 + part2
+        return output_str(text)
+
+class ManaFuzzException(ManaException):
+    def __init__(self, state_model, reason : str):
+        self.state_model = state_model
+        self.reason = reason
+        
+    def __str__(self):
+        text = f'Can not fuzz State Model: "{self.state_model}", {self.reason}'
+        return output_str(text)
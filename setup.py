@@ -12,6 +12,7 @@ setuptools.setup(name='mana',
       install_requires=["pathlib", "flatland", "Jinja2"],
       entry_points={
             "console_scripts": [
-                  "mana=mana.__main__:main"
+                  "mana=mana.__main__:main",
+                  "mana-daemon=mana.daemon:main"
                   ]
             })
@@ -0,0 +1,27 @@
+from types import ModuleType
+
+from mana.derived import DerivedAttributes
+from mana.runtime import MetaClass
+
+
+class Part(MetaClass):
+    attr_list = ['Name', 'Weight']
+    id1_list = ['Name']
+
+
+def test_reused_identifier_is_computed_again():
+    meta_model = ModuleType('meta_model')
+    meta_model.Part = Part
+    derived = DerivedAttributes(meta_model)
+
+    @derived.derivation('Part', 'Heavy')
+    def heavy(part_i):
+        return part_i['Weight'] > 10
+
+    part_i = Part.new(Part.constraint({'Name': 'bolt', 'Weight': 20}))
+    assert derived.value(part_i, 'Heavy')
+    assert derived.value(part_i, 'Heavy')
+    Part.delete(part_i)
+    part_i = Part.new(Part.constraint({'Name': 'bolt', 'Weight': 1}))
+    assert not derived.value(part_i, 'Heavy')
+    assert derived.statistics()['Part.Heavy'] == {'values': 1, 'computed': 2, 'hits': 1}
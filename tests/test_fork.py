@@ -0,0 +1,44 @@
+import pytest
+
+from mana.generators.meta_model_loader import fork_population, load_meta_model, root_module
+from mana.warnings_and_exceptions import ManaException
+
+root_code = compile("from mana.runtime import subsystem_loader\n"
+                    "subsystem_modules = {'Parts': 'parts', 'Orders': 'orders'}\n"
+                    "subsystem_class_names = {'Parts': ['Part'], 'Orders': ['Order']}\n"
+                    "__getattr__ = subsystem_loader(globals())\n", root_module, 'exec')
+
+
+def subsystem_code(class_name: str):
+    return compile(f"from mana.runtime import MetaClass\n"
+                   f"class {class_name}(MetaClass):\n"
+                   f"    attr_list = ['Name']\n"
+                   f"    id1_list = ['Name']\n", class_name, 'exec')
+
+
+def meta_model():
+    return load_meta_model({root_module: root_code, 'parts': subsystem_code('Part'),
+                            'orders': subsystem_code('Order')})
+
+
+def test_parent_is_read_only_once_forked():
+    mm = meta_model()
+    mm.Part.new(mm.Part.constraint({'Name': 'bolt'}))
+    fork = fork_population(mm)
+    fork.Part.new(fork.Part.constraint({'Name': 'nut'}))
+    assert sorted(part_i['Name'] for part_i in fork.Part.all()) == ['bolt', 'nut']
+
+    with pytest.raises(ManaException):
+        mm.Part.new(mm.Part.constraint({'Name': 'washer'}))
+    with pytest.raises(ManaException):
+        mm.Part.delete(mm.Part.constraint({'Name': 'bolt'}))
+    with pytest.raises(ManaException):
+        mm.Order.new(mm.Order.constraint({'Name': 'first'}))  # loaded after the fork
+    assert [part_i['Name'] for part_i in mm.Part.all()] == ['bolt']
+
+    # a fork of a fork
+    fork.Order.new(fork.Order.constraint({'Name': 'first'}))
+    fork_of_fork = fork_population(fork)
+    assert [order_i['Name'] for order_i in fork_of_fork.Order.all()] == ['first']
+    with pytest.raises(ManaException):
+        fork.Order.new(fork.Order.constraint({'Name': 'second'}))
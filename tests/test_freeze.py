@@ -0,0 +1,49 @@
+from types import ModuleType
+
+import pytest
+
+from mana.runtime import FrozenStore, freeze, loaded_classes, subsystem_loader
+from mana.warnings_and_exceptions import ManaException
+
+
+def subsystem_code(class_name: str):
+    return compile(f"from mana.runtime import MetaClass\n"
+                   f"class {class_name}(MetaClass):\n"
+                   f"    attr_list = ['Name']\n"
+                   f"    id1_list = ['Name']\n", class_name, 'exec')
+
+
+def meta_model() -> ModuleType:
+    """ A root module as load_meta_model makes, two subsystems of one class """
+    module = ModuleType('meta_model')
+    namespace = module.__dict__
+    namespace['subsystem_modules'] = {'Parts': 'parts', 'Orders': 'orders'}
+    namespace['subsystem_class_names'] = {'Parts': ['Part'], 'Orders': ['Order']}
+    namespace['subsystem_code'] = {'parts': subsystem_code('Part'), 'orders': subsystem_code('Order')}
+    namespace['__getattr__'] = subsystem_loader(namespace)
+    return module
+
+
+def test_classes_loaded_after_freeze_are_frozen():
+    mm = meta_model()
+    mm.Part.new(mm.Part.constraint({'Name': 'bolt'}))
+    freeze(mm)
+    assert list(loaded_classes(mm)) == ['Part']
+    assert mm.Part.frozen
+
+    order = mm.Order  # loads the Orders subsystem
+    assert order.frozen
+    assert isinstance(order.store, FrozenStore)
+    assert order.query(order.constraint({})) == []
+    with pytest.raises(ManaException):
+        order.new(order.constraint({'Name': 'first'}))
+
+
+def test_frozen_tables_are_read_only():
+    mm = meta_model()
+    mm.Part.new(mm.Part.constraint({'Name': 'bolt'}))
+    table = mm.Part.store.tables[0]
+    freeze(mm)
+    with pytest.raises(TypeError):
+        mm.Part.store.tables[0][('nut',)] = mm.Part.constraint({'Name': 'nut'})
+    assert list(mm.Part.store.tables[0]) == list(table) == [('bolt',)]
@@ -0,0 +1,27 @@
+from array import array
+
+import pytest
+
+from mana.statemachine import CANTHAPPEN, Simulator, StateMachine
+from mana.warnings_and_exceptions import ManaFuzzException
+
+
+def machines() -> dict:
+    # Open --Close--> Closed, Close can not happen in Closed
+    order = StateMachine('Order', 'Shop', ['Open', 'Closed'], ['Close'], array('i', [1, CANTHAPPEN]), [0], set())
+    silent = StateMachine('Silent', 'Shop', ['Idle'], [], array('i'), [0], set())
+    return {('Order', 'Shop'): order, ('Silent', 'Shop'): silent}
+
+
+def test_fuzz():
+    simulator = Simulator(machines())
+    assert simulator.fuzz(('Order', 'Shop'), instances=3, events=10, seed=1) == 10
+    assert simulator.statistics()['instances'] == 3
+
+
+@pytest.mark.parametrize('machine, instances, events', [(('Order', 'Shop'), 0, 10),
+                                                        (('Missing', 'Shop'), 1, 10),
+                                                        (('Silent', 'Shop'), 1, 10)])
+def test_fuzz_arguments(machine, instances, events):
+    with pytest.raises(ManaFuzzException):
+        Simulator(machines()).fuzz(machine, instances, events)
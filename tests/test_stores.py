@@ -0,0 +1,96 @@
+import pytest
+
+from mana.runtime import DictStore, FrozenStore, MetaClass, OverlayStore, SubtypeIndex
+from mana.sqlite_store import SqliteDatabase
+from mana.warnings_and_exceptions import ManaException
+
+
+def part_class() -> type[MetaClass]:
+    """ A class of its own per call, hence a population of its own """
+    class Part(MetaClass):
+        attr_list = ['Name', 'Domain', 'Number']
+        id1_list = ['Name', 'Domain']
+        id2_list = ['Number', 'Domain']
+    return Part
+
+
+def populate(part: type[MetaClass]):
+    for number in range(3):
+        part.new(part.constraint({'Name': f'part {number}', 'Domain': 'Shop', 'Number': number}))
+
+
+def dict_store(part):
+    return DictStore(part)
+
+
+def sqlite_store(part):
+    return SqliteDatabase(':memory:').store(part)
+
+
+def overlay(base_store):
+    """ A fork of a populated class in base_store """
+    def store(part):
+        parent = part_class()
+        parent.store = base_store(parent)
+        populate(parent)
+        return OverlayStore(part, parent.store)
+    return store
+
+
+stores = {'dict': dict_store,
+          'sqlite': sqlite_store,
+          'overlay on dict': overlay(dict_store),
+          'overlay on sqlite': overlay(sqlite_store)}
+
+
+@pytest.mark.parametrize('store', stores.values(), ids=stores.keys())
+def test_delete(store):
+    part = part_class()
+    part.store = store(part)
+    if not len(part.store):
+        populate(part)
+    version = part.version
+
+    part.delete(part.constraint({'Name': 'part 1', 'Domain': 'Shop', 'Number': 1}))
+    assert part.version == version + 1
+    assert len(part.store) == 2
+    assert part.query(part.constraint({'Name': 'part 1', 'Domain': 'Shop'})) == []
+    assert part.query(part.constraint({'Number': 1, 'Domain': 'Shop'})) == []
+    assert sorted(instance['Number'] for instance in part.all()) == [0, 2]
+
+    # the identifiers are free again
+    part.new(part.constraint({'Name': 'part 1', 'Domain': 'Shop', 'Number': 1}))
+    assert len(part.store) == 3
+    with pytest.raises(ManaException):
+        part.delete(part.constraint({'Name': 'part 9', 'Domain': 'Shop', 'Number': 9}))
+
+
+def test_delete_pending_sqlite_row():
+    part = part_class()
+    part.store = sqlite_store(part)
+    populate(part)  # below batch_size, the rows are still pending
+    part.delete(part.constraint({'Name': 'part 0', 'Domain': 'Shop', 'Number': 0}))
+    assert not part.store.contains(0, ('part 0', 'Shop'))
+    assert not part.store.contains(1, (0, 'Shop'))
+    assert len(part.store) == 2
+
+
+def test_delete_frozen():
+    part = part_class()
+    populate(part)
+    part.freeze()
+    assert isinstance(part.store, FrozenStore)
+    with pytest.raises(ManaException):
+        part.delete(part.constraint({'Name': 'part 0', 'Domain': 'Shop', 'Number': 0}))
+
+
+def test_empty_subtype_index():
+    part = part_class()
+    populate(part)
+    subtype_index = SubtypeIndex(part, {})  # no subclass links
+    assert subtype_index.id_list == ['Name', 'Domain']
+    assert subtype_index.instances == {}
+
+    class Note(MetaClass):
+        attr_list = ['Text']
+    assert SubtypeIndex(Note, {}).id_list == []